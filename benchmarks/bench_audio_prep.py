@@ -0,0 +1,82 @@
+"""Upload size and estimated upload time with and without audio pre-processing.
+
+Runs every audio clip under voice_to_image/screenshots/ through
+`preprocess_audio` and reports bytes before and after, the pre-processing
+time, and the time to upload either version over a link of --uplink-mbps.
+Needs ffmpeg on PATH or in FFMPEG_BINARY.
+
+    python benchmarks/bench_audio_prep.py
+    python benchmarks/bench_audio_prep.py --uplink-mbps 2 --runs 5 --json
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+AUDIO_EXTENSIONS = {".mp3", ".mp4", ".m4a", ".webm", ".wav", ".ogg"}
+
+
+def run(clips, runs: int, uplink_mbps: float) -> list:
+    sys.path.insert(0, str(ROOT / "voice_to_image"))
+    from audio_prep import preprocess_audio
+
+    bytes_per_second = uplink_mbps * 1e6 / 8
+    report = []
+    for clip in clips:
+        data = clip.read_bytes()
+        times, output = [], None
+        for _ in range(runs):
+            started = time.perf_counter()
+            output, name = preprocess_audio(data, clip.name)
+            times.append((time.perf_counter() - started) * 1000)
+        prep_ms = statistics.median(times)
+        before_ms = len(data) / bytes_per_second * 1000
+        after_ms = len(output) / bytes_per_second * 1000
+        report.append({
+            "clip": str(clip.relative_to(ROOT)),
+            "bytes_before": len(data),
+            "bytes_after": len(output),
+            "output": name,
+            "ratio": round(len(data) / len(output), 1),
+            "prep_ms": round(prep_ms, 1),
+            "upload_ms_before": round(before_ms, 1),
+            "upload_ms_after": round(after_ms + prep_ms, 1),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("clips", nargs="*", type=Path,
+                        help="audio files (default: voice_to_image/screenshots/**)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--uplink-mbps", type=float, default=5.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT / "voice_to_image"))
+    from audio_prep import ffmpeg_binary
+
+    if not ffmpeg_binary():
+        sys.exit("ffmpeg not found; install it or set FFMPEG_BINARY")
+    clips = [p.resolve() for p in args.clips] or sorted(
+        p for p in (ROOT / "voice_to_image" / "screenshots").rglob("*")
+        if p.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+    report = run(clips, args.runs, args.uplink_mbps)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"uplink {args.uplink_mbps} Mbit/s; 'after' upload time includes pre-processing")
+        for r in report:
+            print(f"  {r['bytes_before']:>9,} B -> {r['bytes_after']:>8,} B  x{r['ratio']:<5} "
+                  f"prep {r['prep_ms']:>6.1f} ms  upload {r['upload_ms_before']:>7.1f} -> "
+                  f"{r['upload_ms_after']:>7.1f} ms  {r['clip']}")
+
+
+if __name__ == "__main__":
+    main()
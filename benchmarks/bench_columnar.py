@@ -0,0 +1,126 @@
+"""SQLite vs columnar sidecar on aggregation queries.
+
+Generates a synthetic sales table, ingests it with COLUMNAR_SIDECAR=1 in a
+scratch directory, then runs each query on both engines, checks that the
+results are identical, and reports median latencies.
+
+    python benchmarks/bench_columnar.py
+    python benchmarks/bench_columnar.py --rows 5000000 --runs 3 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+QUERIES = [
+    "SELECT COUNT(*) FROM user_data",
+    "SELECT SUM(units), AVG(price) FROM user_data",
+    "SELECT region, SUM(revenue) AS revenue FROM user_data GROUP BY region ORDER BY revenue DESC",
+    "SELECT product, COUNT(*), AVG(units), MAX(price) FROM user_data GROUP BY product",
+    "SELECT region, channel, SUM(units) FROM user_data WHERE order_date >= '2024-07-01' "
+    "GROUP BY region, channel",
+    "SELECT product, SUM(revenue) AS total FROM user_data WHERE region IN ('North', 'South') "
+    "AND units > 5 GROUP BY product ORDER BY total DESC LIMIT 5",
+    "SELECT channel, COUNT(DISTINCT product), MIN(order_date) FROM user_data GROUP BY channel",
+    # Outside the supported subset: answered by SQLite on both paths.
+    "SELECT region, SUM(units * price) FROM user_data GROUP BY region",
+]
+
+
+def make_csv(path: Path, rows: int, seed: int = 7):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    products = np.array([f"Product {i:03d}" for i in range(200)])
+    dates = pd.date_range("2024-01-01", "2024-12-31").strftime("%Y-%m-%d").to_numpy()
+    units = rng.integers(1, 20, rows)
+    price = rng.integers(100, 50000, rows) / 100
+    pd.DataFrame({
+        "order_date": rng.choice(dates, rows),
+        "region": rng.choice(["North", "South", "East", "West", "Central"], rows),
+        "channel": rng.choice(["Online", "Retail", "Partner"], rows),
+        "product": rng.choice(products, rows),
+        "units": units,
+        "price": price,
+        "revenue": np.round(units * price, 2),
+    }).to_csv(path, index=False)
+
+
+def _median_ms(fn, runs: int):
+    times, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), result
+
+
+def run(rows: int, runs: int) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="bench_columnar_"))
+    os.chdir(workdir)
+    os.environ["COLUMNAR_SIDECAR"] = "1"
+    sys.path.insert(0, str(ROOT / "chat_with_data"))
+    import columnar
+    import db
+
+    csv_path = workdir / "sales.csv"
+    make_csv(csv_path, rows)
+    started = time.perf_counter()
+    db.create_and_load_table(str(csv_path), dataset_id="bench")
+    ingest_s = time.perf_counter() - started
+
+    path = columnar.sidecar_path(db.dataset_path("bench"))
+    version = db.get_data_version("bench")
+    report = {"rows": rows, "ingest_s": round(ingest_s, 2),
+              "sidecar_mb": round(os.path.getsize(path) / 2 ** 20, 1), "queries": []}
+    for sql in QUERIES:
+        with db.read_connection("bench") as conn:
+            sqlite_ms, expected = _median_ms(lambda: db._fetch_result(conn, sql, 10 ** 9), runs)
+        columnar_ms, answer = _median_ms(lambda: columnar.query(path, version, sql), runs)
+        entry = {"sql": sql, "sqlite_ms": round(sqlite_ms, 1)}
+        if answer is None:
+            entry.update(columnar_ms=None, speedup=None, identical=None)
+        else:
+            columns, result_rows = answer
+            entry.update(
+                columnar_ms=round(columnar_ms, 1),
+                speedup=round(sqlite_ms / columnar_ms, 1),
+                identical=(columns, result_rows) == (expected.columns, expected.rows),
+            )
+        report["queries"].append(entry)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['rows']:,} rows, ingest {report['ingest_s']} s, "
+              f"sidecar {report['sidecar_mb']} MB")
+        for q in report["queries"]:
+            if q["columnar_ms"] is None:
+                print(f"  sqlite {q['sqlite_ms']:>8.1f} ms  columnar     (fallback)  {q['sql'][:70]}")
+            else:
+                status = "identical" if q["identical"] else "MISMATCH"
+                print(f"  sqlite {q['sqlite_ms']:>8.1f} ms  columnar {q['columnar_ms']:>7.1f} ms "
+                      f"x{q['speedup']:<5} {status}  {q['sql'][:70]}")
+
+    sys.exit(0 if all(q["identical"] is not False for q in report["queries"]) else 1)
+
+
+if __name__ == "__main__":
+    main()
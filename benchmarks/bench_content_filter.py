@@ -0,0 +1,110 @@
+"""Per-term regex loop vs the compiled single-pass content filter.
+
+Builds synthetic restricted-term lists of growing size (a quarter of them
+stems), filters a ~150-word prompt with both implementations, checks that
+exact-term lists give identical output, and reports median latency per
+prompt. The legacy loop is only timed up to --legacy-max terms; beyond that
+it takes seconds per prompt.
+
+    python benchmarks/bench_content_filter.py
+    python benchmarks/bench_content_filter.py --sizes 25 1000 10000 50000 --json
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import string
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROMPT = (
+    "Create a surreal and ethereal scene of the Garden of Eden bathed in golden morning light. "
+    "Lush, towering trees heavy with glowing fruit frame a crystal-clear river that winds through "
+    "meadows of wildflowers. A gentle mist drifts over the water while exotic birds with iridescent "
+    "feathers perch on twisted branches. In the distance, a waterfall spills from moss-covered "
+    "cliffs into a turquoise pool. Soft rays of sunlight pierce the canopy, casting dappled "
+    "shadows on the grass. The color palette blends emerald greens, warm golds and pastel pinks. "
+    "Painted in the style of a romantic-era oil painting with fine brushwork, rich textures and a "
+    "dreamy, peaceful mood. Hidden among the leaves, a serpent coils around a branch, while a "
+    "deer and a lion rest side by side near the water's edge, a symbol of harmony. Include a war "
+    "memorial, a broken gun and a fight between two shadows in the far background."
+)
+
+
+def legacy_filter(raw_text: str, terms) -> str:
+    filtered_text = raw_text.lower()
+    for restricted_word in terms:
+        filtered_text = re.sub(rf"\b{restricted_word}\b", "", filtered_text, flags=re.IGNORECASE)
+    filtered_text = re.sub(r"[^a-zA-Z0-9\s,\.]", "", filtered_text)
+    return re.sub(r"\s+", " ", filtered_text).strip()
+
+
+def make_terms(size: int, stems: bool, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    terms = {"war", "gun", "fight"}
+    while len(terms) < size:
+        terms.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    terms = sorted(terms)[:size]
+    if stems:
+        terms = [t + "*" if i % 4 == 0 else t for i, t in enumerate(terms)]
+    return terms
+
+
+def _median_us(fn, runs: int):
+    times, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(times), result
+
+
+def run(sizes, runs: int, legacy_max: int) -> list:
+    sys.path.insert(0, str(ROOT / "voice_to_image"))
+    from content_filter import ContentFilter
+
+    report = []
+    for size in sizes:
+        started = time.perf_counter()
+        engine = ContentFilter(make_terms(size, stems=True))
+        compile_ms = (time.perf_counter() - started) * 1000
+        filter_us, result = _median_us(lambda: engine.apply(PROMPT), runs)
+        entry = {"terms": size, "compile_ms": round(compile_ms, 1), "filter_us": round(filter_us, 1),
+                 "hits": sum(result.hits.values()), "legacy_us": None, "identical": None}
+
+        if size <= legacy_max:
+            exact = make_terms(size, stems=False)
+            legacy_us, expected = _median_us(lambda: legacy_filter(PROMPT, exact), runs)
+            entry["legacy_us"] = round(legacy_us, 1)
+            entry["identical"] = ContentFilter(exact).apply(PROMPT).text == expected
+        report.append(entry)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--legacy-max", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.runs, args.legacy_max)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for r in report:
+            legacy = f"{r['legacy_us']:>10.1f} us" if r["legacy_us"] is not None else "   (skipped)  "
+            status = {True: "identical", False: "MISMATCH", None: ""}[r["identical"]]
+            print(f"{r['terms']:>7,} terms  compile {r['compile_ms']:>7.1f} ms  "
+                  f"filter {r['filter_us']:>7.1f} us  legacy {legacy}  {r['hits']} hits  {status}")
+
+    sys.exit(0 if all(r["identical"] is not False for r in report) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Scaling benchmark for the chat_with_data data path.
+
+Generates synthetic mixed-type CSVs at each requested size and runs every
+stage of the data path in its own interpreter, so peak RSS is per stage:
+
+    ingest        create_and_load_table on the CSV
+    stats         get_stats
+    safe_execute  a mix of filters, aggregates and sorts, result cache cleared
+    cached        the same queries answered from the result cache
+    chart         make_chart on a grouped result handle
+    agent         stream_answer end to end, with a local stub in place of OpenAI
+
+Reports throughput, p50/p95 latency and peak RSS per stage as JSON, and can
+save it as a baseline or compare against one (exit 1 on regression).
+
+    python benchmarks/bench_data_path.py --sizes 500,100000 --output report.json
+    python benchmarks/bench_data_path.py --sizes 500,100000,10000000 --baseline report.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "chat_with_data"
+
+DEFAULT_SIZES = [500, 10_000, 100_000, 1_000_000]
+STAGES = ["ingest", "stats", "safe_execute", "cached", "chart", "agent"]
+GENERATE_CHUNK_ROWS = 500_000
+DATASET_ID = "bench"
+
+QUERIES = [
+    "SELECT COUNT(*) FROM user_data WHERE quantity > 10",
+    "SELECT category, SUM(amount) AS total FROM user_data GROUP BY category ORDER BY total DESC",
+    "SELECT region, AVG(discount), COUNT(*) FROM user_data WHERE returned = 0 GROUP BY region",
+    "SELECT * FROM user_data WHERE order_date BETWEEN '2023-03-01' AND '2023-03-31' LIMIT 50",
+    "SELECT customer, amount FROM user_data ORDER BY amount DESC LIMIT 20",
+    "SELECT strftime('%Y-%m', order_date) AS month, SUM(quantity) FROM user_data GROUP BY month",
+    "SELECT category, region, MAX(amount) FROM user_data WHERE note IS NOT NULL GROUP BY 1, 2",
+]
+CHART_QUERY = "SELECT category, SUM(amount) AS total FROM user_data GROUP BY category"
+AGENT_QUESTIONS = [
+    "Total sales amount by category?",
+    "How many orders per region?",
+    "Average discount by category?",
+]
+
+
+# --- data ---------------------------------------------------------------------
+
+def generate_csv(path: Path, rows: int, seed: int = 11):
+    """Mixed types: ints, floats, categories, free text, dates, 0/1 flags and NULLs."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-01-01", "2024-12-31").strftime("%Y-%m-%d").to_numpy()
+    categories = np.array(["Electronics", "Grocery", "Clothing", "Toys", "Garden", "Books", "Sports"])
+    regions = np.array(["North", "South", "East", "West"])
+    customers = np.array([f"Customer {i:05d}" for i in range(20_000)])
+    written = 0
+    with open(path, "w", newline="") as f:
+        while written < rows:
+            n = min(GENERATE_CHUNK_ROWS, rows - written)
+            note = rng.choice(np.array(["gift", "priority", "bulk order, repeat"], dtype=object), n)
+            note[rng.random(n) < 0.6] = None
+            pd.DataFrame({
+                "order_id": np.arange(written + 1, written + n + 1),
+                "order_date": rng.choice(dates, n),
+                "customer": rng.choice(customers, n),
+                "category": rng.choice(categories, n),
+                "region": rng.choice(regions, n),
+                "quantity": rng.integers(1, 25, n),
+                "amount": np.round(rng.gamma(2.0, 40.0, n), 2),
+                "discount": np.where(rng.random(n) < 0.2, np.nan, np.round(rng.random(n) * 0.3, 3)),
+                "returned": (rng.random(n) < 0.05).astype(int),
+                "note": note,
+            }).to_csv(f, index=False, header=written == 0)
+            written += n
+
+
+# --- stub LLM -----------------------------------------------------------------
+
+def _chunk(content=None, tool_call=None):
+    delta = SimpleNamespace(content=content, tool_calls=[tool_call] if tool_call else None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def _tool_call(name: str, arguments: dict):
+    function = SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    return SimpleNamespace(index=0, id=f"call_{name}", function=function)
+
+
+class StubCompletions:
+    """Scripted stand-in for chat.completions: run_sql, then make_chart, then text."""
+
+    def create(self, messages, tool_choice="auto", **kwargs):
+        tool_results = [m for m in messages if m.get("role") == "tool"]
+        if tool_choice == "none" or len(tool_results) >= 2:
+            words = "Here is the breakdown you asked for, based on the query results.".split()
+            return iter([_chunk(content=w + " ") for w in words])
+        if not tool_results:
+            return iter([_chunk(tool_call=_tool_call("run_sql", {"query": CHART_QUERY}))])
+        result_id = tool_results[-1]["content"].split("\n", 1)[0].split(": ", 1)[-1]
+        return iter([_chunk(tool_call=_tool_call("make_chart", {"result_id": result_id}))])
+
+
+def install_stub_llm(agent):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions()))
+    agent._openai = lambda: client
+
+
+# --- stages (run in a child interpreter) --------------------------------------
+
+def _timed(fn, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def run_stage(stage: str, rows: int, csv_path: Path, repeat: int) -> dict:
+    sys.path.insert(0, str(APP_DIR))
+    import db
+
+    work = {"rows": rows}
+    if stage == "ingest":
+        samples = _timed(lambda: db.create_and_load_table(str(csv_path), dataset_id=DATASET_ID), 1)
+        work.update(ops=1, items=rows, unit="rows", bytes=csv_path.stat().st_size)
+    elif stage == "stats":
+        samples = _timed(lambda: db.get_stats(DATASET_ID), repeat)
+        work.update(ops=repeat, items=repeat, unit="calls")
+    elif stage in ("safe_execute", "cached"):
+        for sql in QUERIES:  # warm-up, and fills the cache for the "cached" stage
+            result = db.safe_execute(sql, dataset_id=DATASET_ID)
+            if result.startswith(("SQL ERROR", "BLOCKED")):
+                raise RuntimeError(f"{sql}: {result}")
+        samples = []
+        for _ in range(repeat):
+            for sql in QUERIES:
+                if stage == "safe_execute":
+                    db.RESULT_CACHE.clear()
+                started = time.perf_counter()
+                db.safe_execute(sql, dataset_id=DATASET_ID)
+                samples.append(time.perf_counter() - started)
+        work.update(ops=len(samples), items=len(samples), unit="queries")
+    elif stage == "chart":
+        import agent
+
+        result_id = db.safe_execute(CHART_QUERY, dataset_id=DATASET_ID).split("\n", 1)[0].split(": ")[1]
+        samples = _timed(lambda: agent.make_chart(result_id), repeat)
+        work.update(ops=repeat, items=repeat, unit="charts")
+    elif stage == "agent":
+        import agent
+
+        install_stub_llm(agent)
+        samples = []
+        for i in range(repeat):
+            question = f"{AGENT_QUESTIONS[i % len(AGENT_QUESTIONS)]} (run {i})"
+            db.RESULT_CACHE.clear()
+            started = time.perf_counter()
+            answer = agent.get_answer(question, dataset_id=DATASET_ID)
+            samples.append(time.perf_counter() - started)
+            if not answer.startswith("data:image/"):
+                raise RuntimeError(f"stub agent run did not end in a chart: {answer[:200]}")
+        work.update(ops=repeat, items=repeat, unit="answers")
+    else:
+        raise ValueError(f"unknown stage {stage!r}")
+
+    work["samples_s"] = samples
+    work["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return work
+
+
+# --- parent -------------------------------------------------------------------
+
+def _percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered) + 0.5) - 1))]
+
+
+def summarize(work: dict) -> dict:
+    samples = work["samples_s"]
+    total = sum(samples)
+    summary = {
+        "ops": work["ops"],
+        "p50_ms": round(_percentile(samples, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+        "throughput": round(work["items"] / total, 1) if total else None,
+        "throughput_unit": f"{work['unit']}/s",
+        "peak_rss_mb": round(work["peak_rss_kb"] / 1024, 1),
+    }
+    if "bytes" in work and total:
+        summary["mb_per_s"] = round(work["bytes"] / 2 ** 20 / total, 1)
+    return summary
+
+
+def _child(stage: str, rows: int, workdir: Path, csv_path: Path, repeat: int, env: dict) -> dict:
+    proc = subprocess.run(
+        [sys.executable, __file__, "--stage", stage, "--rows", str(rows), "--csv", str(csv_path),
+         "--repeat", str(repeat)],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{stage} at {rows:,} rows failed:\n{proc.stderr[-3000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(sizes: list, stages: list, repeat: int, index_advisor: bool, keep: bool) -> dict:
+    env = dict(os.environ, INDEX_ADVISOR="1" if index_advisor else "0", PYTHONUNBUFFERED="1")
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "index_advisor": index_advisor,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "sizes": {},
+    }
+    for rows in sizes:
+        workdir = Path(tempfile.mkdtemp(prefix=f"bench_data_path_{rows}_"))
+        try:
+            csv_path = workdir / "synthetic.csv"
+            started = time.perf_counter()
+            generate_csv(csv_path, rows)
+            print(f"[bench] {rows:,} rows: generated {csv_path.stat().st_size / 2 ** 20:.1f} MB "
+                  f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            results = {}
+            for stage in ["ingest"] + [s for s in stages if s != "ingest"]:
+                results[stage] = summarize(_child(stage, rows, workdir, csv_path, repeat, env))
+                print(f"[bench] {rows:,} rows: {stage:<12} p50 {results[stage]['p50_ms']:>10.2f} ms  "
+                      f"p95 {results[stage]['p95_ms']:>10.2f} ms  "
+                      f"rss {results[stage]['peak_rss_mb']:>7.1f} MB", file=sys.stderr)
+            report["sizes"][str(rows)] = {s: results[s] for s in stages if s in results}
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Stages whose p50 latency or peak RSS grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for rows, stages in report["sizes"].items():
+        for stage, current in stages.items():
+            before = baseline.get("sizes", {}).get(rows, {}).get(stage)
+            if not before:
+                continue
+            for metric in ("p50_ms", "peak_rss_mb"):
+                if before[metric] and current[metric] > before[metric] * (1 + tolerance):
+                    regressions.append({
+                        "rows": int(rows), "stage": stage, "metric": metric,
+                        "baseline": before[metric], "current": current[metric],
+                        "ratio": round(current[metric] / before[metric], 2),
+                    })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated row counts, e.g. 500,100000,10000000")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=5, help="samples per stage (ingest runs once)")
+    parser.add_argument("--index-advisor", action="store_true",
+                        help="leave the background index advisor on (off for stable timings)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against a saved report")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative growth before a metric counts as a regression")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--csv", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        work = run_stage(args.stage, args.rows, Path(args.csv), args.repeat)
+        print(json.dumps(work))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run(sizes, stages, args.repeat, args.index_advisor, args.keep)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
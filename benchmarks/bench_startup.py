@@ -0,0 +1,99 @@
+"""Import-time budget for both Streamlit apps.
+
+Runs `python -X importtime` on each app's own modules (everything app.py imports
+besides Streamlit itself) in a fresh interpreter, reports the median cumulative
+cost and the heaviest top-level imports, and exits non-zero if an app exceeds
+its budget.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget chat_with_data=150 --runs 7 --json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+APPS = {
+    "chat_with_data": ["db", "agent", "ticket"],
+    "voice_to_image": ["agent", "utils"],
+}
+DEFAULT_BUDGET_MS = {"chat_with_data": 150.0, "voice_to_image": 100.0}
+
+
+def _import_costs(code: str, cwd: Path) -> dict:
+    """Cumulative ms per top-level module imported by `code` in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{cwd.name}: import failed\n{proc.stderr[-2000:]}")
+
+    costs = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            costs[name.strip()] = int(cumulative) / 1000
+    return costs
+
+
+def measure(app: str, modules: list) -> dict:
+    """Import cost of `modules`, minus what the bare interpreter imports at startup."""
+    cwd = ROOT / app
+    baseline = _import_costs("pass", cwd)
+    costs = _import_costs("; ".join(f"import {m}" for m in modules), cwd)
+    return {name: ms for name, ms in costs.items() if name not in baseline}
+
+
+def run(runs: int, budgets: dict) -> dict:
+    report = {}
+    for app, modules in APPS.items():
+        samples = [measure(app, modules) for _ in range(runs)]
+        totals = [sum(s.values()) for s in samples]
+        heaviest = sorted(samples[-1].items(), key=lambda kv: kv[1], reverse=True)[:8]
+        total = statistics.median(totals)
+        report[app] = {
+            "modules": modules,
+            "median_ms": round(total, 1),
+            "min_ms": round(min(totals), 1),
+            "budget_ms": budgets[app],
+            "ok": total <= budgets[app],
+            "heaviest": [{"module": m, "ms": round(ms, 1)} for m, ms in heaviest],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", action="append", default=[], metavar="APP=MS",
+                        help="override an app's budget in milliseconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGET_MS)
+    for item in args.budget:
+        app, ms = item.split("=", 1)
+        budgets[app] = float(ms)
+
+    report = run(args.runs, budgets)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for app, r in report.items():
+            status = "OK" if r["ok"] else "OVER BUDGET"
+            print(f"{app}: {r['median_ms']} ms median (budget {r['budget_ms']} ms) {status}")
+            for item in r["heaviest"]:
+                print(f"    {item['ms']:>8.1f} ms  {item['module']}")
+
+    sys.exit(0 if all(r["ok"] for r in report.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
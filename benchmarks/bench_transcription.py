@@ -0,0 +1,164 @@
+"""Single-request vs segmented parallel transcription of a long recording.
+
+Synthesizes a voice memo in which every "word" is a short tone at its own
+pitch, separated by short gaps and sentence pauses. A fake backend transcribes
+by finding the tones and naming each by pitch, and sleeps in proportion to the
+audio length like a real speech-to-text API. The memo is transcribed once as
+a single request and once through SegmentedTranscriber. Both transcripts are
+checked against the script: overlap stitching must neither drop nor repeat words.
+Needs numpy, and ffmpeg on PATH or in FFMPEG_BINARY.
+
+    python benchmarks/bench_transcription.py
+    python benchmarks/bench_transcription.py --minutes 30 --workers 8 --json
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import time
+import wave
+from difflib import SequenceMatcher
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+RATE = 16000
+WORD_SECONDS = 0.35
+GAP_SECONDS = 0.12
+PAUSE_SECONDS = 0.7
+VOCABULARY = [f"w{i:02d}" for i in range(40)]
+FREQUENCIES = [300 + 60 * i for i in range(len(VOCABULARY))]
+
+
+def make_memo(minutes: float, seed: int = 7):
+    """WAV bytes of the memo and the words spoken in it."""
+    import numpy as np
+
+    rng = random.Random(seed)
+    noise = np.random.default_rng(seed)
+    t = np.arange(int(WORD_SECONDS * RATE)) / RATE
+    envelope = np.minimum(1.0, np.minimum(t, WORD_SECONDS - t) / 0.02)
+    tones = [0.3 * envelope * np.sin(2 * np.pi * f * t) for f in FREQUENCIES]
+
+    parts, script, seconds = [], [], 0.0
+    while seconds < minutes * 60:
+        for _ in range(rng.randint(6, 14)):
+            index = rng.randrange(len(VOCABULARY))
+            parts += [tones[index], np.zeros(int(GAP_SECONDS * RATE))]
+            script.append(VOCABULARY[index])
+            seconds += WORD_SECONDS + GAP_SECONDS
+        parts.append(np.zeros(int(PAUSE_SECONDS * RATE)))
+        seconds += PAUSE_SECONDS
+    signal = np.concatenate(parts)
+    signal += noise.normal(0, 0.001, len(signal))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes((np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue(), script
+
+
+class FakeTranscriber:
+    """Names each tone by its pitch; takes base + per_second * audio length seconds."""
+
+    def __init__(self, base_seconds: float, per_audio_second: float):
+        self.base_seconds = base_seconds
+        self.per_audio_second = per_audio_second
+
+    def __call__(self, audio_data: bytes, filename: str) -> str:
+        import numpy as np
+
+        with wave.open(io.BytesIO(audio_data), "rb") as wav:
+            rate = wav.getframerate()
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), "<i2") / 32768
+        time.sleep(self.base_seconds + self.per_audio_second * len(samples) / rate)
+
+        frame = rate // 100
+        loud = np.abs(samples[:len(samples) // frame * frame]).reshape(-1, frame).max(axis=1) > 0.05
+        words, start = [], None
+        for i, active in enumerate(np.append(loud, False)):
+            if active and start is None:
+                start = i
+            elif not active and start is not None:
+                # Tones cut by a segment edge are heard if at least half is there.
+                if (i - start) / 100 >= WORD_SECONDS / 2:
+                    burst = samples[start * frame:i * frame]
+                    crossings = np.count_nonzero(np.diff(np.signbit(burst)))
+                    pitch = crossings / 2 / (len(burst) / rate)
+                    nearest = min(range(len(FREQUENCIES)), key=lambda k: abs(FREQUENCIES[k] - pitch))
+                    words.append(VOCABULARY[nearest])
+                start = None
+        return " ".join(words)
+
+
+def run(minutes: float, segment_seconds: float, workers: int, base: float, per_second: float) -> dict:
+    sys.path.insert(0, str(ROOT / "voice_to_image"))
+    from transcription import SegmentedTranscriber
+
+    memo, script = make_memo(minutes)
+    backend = FakeTranscriber(base, per_second)
+    report = {"minutes": minutes, "words": len(script), "wav_mb": round(len(memo) / 2 ** 20, 1)}
+
+    started = time.perf_counter()
+    single = backend(memo, "memo.wav")
+    report["single_s"] = round(time.perf_counter() - started, 2)
+
+    segment_times = []
+
+    def timed_backend(audio_data, filename):
+        started = time.perf_counter()
+        text = backend(audio_data, filename)
+        segment_times.append(time.perf_counter() - started)
+        return text
+
+    transcriber = SegmentedTranscriber(timed_backend, segment_seconds=segment_seconds, max_workers=workers)
+    started = time.perf_counter()
+    segmented = transcriber.transcribe(memo, "memo.wav")
+    report.update(
+        segmented_s=round(time.perf_counter() - started, 2),
+        segments=len(segment_times),
+        slowest_segment_s=round(max(segment_times, default=0), 2),
+    )
+    for name, text in (("single", single), ("segmented", segmented)):
+        words = text.split()
+        report[f"{name}_identical"] = words == script
+        report[f"{name}_word_match"] = round(SequenceMatcher(None, words, script, autojunk=False).ratio(), 4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--segment-seconds", type=float, default=60)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--base-latency", type=float, default=0.3, help="fake backend seconds per request")
+    parser.add_argument("--per-audio-second", type=float, default=0.01,
+                        help="fake backend seconds per second of audio")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT / "voice_to_image"))
+    from audio_prep import ffmpeg_binary
+
+    if not ffmpeg_binary():
+        sys.exit("ffmpeg not found; install it or set FFMPEG_BINARY")
+    report = run(args.minutes, args.segment_seconds, args.workers, args.base_latency, args.per_audio_second)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['minutes']} min memo, {report['words']:,} words, {report['wav_mb']} MB WAV")
+        print(f"  single request   {report['single_s']:>6.2f} s  word match {report['single_word_match']:.4f}"
+              f"  identical {report['single_identical']}")
+        print(f"  {report['segments']:>2} segments      {report['segmented_s']:>6.2f} s  word match "
+              f"{report['segmented_word_match']:.4f}  identical {report['segmented_identical']}"
+              f"  (slowest segment {report['slowest_segment_s']:.2f} s)")
+
+    sys.exit(0 if report["segmented_identical"] or not report["single_identical"] else 1)
+
+
+if __name__ == "__main__":
+    main()
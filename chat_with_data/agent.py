@@ -1,38 +1,96 @@
 import os
-import openai
 import json
-import sqlite3
-import pandas as pd
-from db import safe_execute, DB_PATH
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from db import safe_execute, read_connection, get_data_version, get_profile, get_schema_fingerprint, get_result
+from charts import render_bar_chart
+from plan_cache import PlanCache
+from schema import is_numeric_type
+from telemetry import span, bind
 from dotenv import load_dotenv
-import base64
-from io import BytesIO
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "4"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+
+TOOL_ERROR_PREFIXES = ("BLOCKED", "SQL ERROR", "Tool error", "Chart error", "Unknown tool")
+
+_plan_cache = None
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+def _openai():
+    """The openai module, imported on first use to keep app startup fast."""
+    import openai
+    if openai.api_key is None:
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+def _plans() -> PlanCache:
+    global _plan_cache
+    if _plan_cache is None:
+        _plan_cache = PlanCache()
+    return _plan_cache
+
+def _profile_lines(dataset_id: Optional[str] = None) -> str:
+    lines = []
+    for c in get_profile(dataset_id):
+        line = f"- {c['column_name']}: {c['null_count']} nulls, ~{c['distinct_approx']} distinct"
+        if is_numeric_type(c["sql_type"]):
+            if c["min_value"] is not None:
+                line += f", min {c['min_value']}, max {c['max_value']}"
+        elif c["top_values"]:
+            line += ", top values: " + ", ".join(repr(v) for v, _ in c["top_values"])
+        lines.append(line)
+    return "\n".join(lines)
+
+def get_table_context(dataset_id: Optional[str] = None) -> str:
+    import pandas as pd
 
-def get_table_context() -> str:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(user_data)")
-        cols = [f"{row[1]} ({row[2]})" for row in cur.fetchall()]
-        schema = ", ".join(cols)
-        sample = pd.read_sql_query("SELECT * FROM user_data LIMIT 5", conn)
-        conn.close()
-        return f"Table: user_data\nColumns: {schema}\n\nSample rows:\n{sample.to_string(index=False)}"
+        with read_connection(dataset_id) as conn:
+            cur = conn.cursor()
+            cur.execute("PRAGMA table_info(user_data)")
+            cols = [f"{row[1]} ({row[2]})" for row in cur.fetchall()]
+            schema = ", ".join(cols)
+            sample = pd.read_sql_query("SELECT * FROM user_data LIMIT 5", conn)
+        profile = _profile_lines(dataset_id)
+        profile = f"\n\nColumn profile:\n{profile}" if profile else ""
+        return f"Table: user_data\nColumns: {schema}{profile}\n\nSample rows:\n{sample.to_string(index=False)}"
     except Exception as e:
         return "No data loaded yet."
 
-TABLE_CONTEXT = get_table_context()
+_context_cache = {}  # dataset_id -> (data version, context text)
+_context_lock = threading.Lock()
+
+def table_context(dataset_id: Optional[str] = None) -> str:
+    """Schema/sample prompt block, built on first use and rebuilt only after a reload."""
+    try:
+        version = get_data_version(dataset_id)
+    except Exception:
+        return "No data loaded yet."
+    with _context_lock:
+        cached = _context_cache.get(dataset_id)
+        if cached is None or cached[0] != version:
+            cached = _context_cache[dataset_id] = (version, get_table_context(dataset_id))
+        return cached[1]
 
 tools = [
     {
         "type": "function",
         "function": {
             "name": "run_sql",
-            "description": "Run a safe SELECT query on user_data and return results as markdown table.",
+            "description": (
+                "Run a safe SELECT query on user_data. Returns 'result_id: <id>', then the rows "
+                "as compact CSV with a header line. Columns with one value in every row are "
+                "stated once on a 'Same in ...' line instead. If rows were left out, a line says "
+                "how many and per-column summary statistics follow; use SQL aggregates for "
+                "exact answers over all rows."
+            ),
             "parameters": {
                 "type": "object",
                 "properties": {"query": {"type": "string"}},
@@ -44,19 +102,223 @@ tools = [
         "type": "function",
         "function": {
             "name": "make_chart",
-            "description": "Generate a bar chart from a markdown table.",
+            "description": (
+                "Generate a bar chart from a run_sql result. Pass its result_id; "
+                "optionally name the label column (x) and the numeric column (y)."
+            ),
             "parameters": {
                 "type": "object",
-                "properties": {"markdown_table": {"type": "string"}},
-                "required": ["markdown_table"]
+                "properties": {
+                    "result_id": {"type": "string"},
+                    "x": {"type": "string"},
+                    "y": {"type": "string"}
+                },
+                "required": ["result_id"]
             }
         }
     }
 ]
 
-def get_answer(user_question: str) -> str:
+def make_chart(result_id: str, x: str = None, y: str = None) -> str:
+    result = get_result(result_id)
+    if result is None:
+        raise ValueError(f"unknown or expired result_id {result_id!r}; run the query again")
+    with span("chart", result_id=result_id, rows=len(result.rows)) as s:
+        chart = render_bar_chart(result.to_frame(), x, y)
+        s.set(bytes=len(chart))
+    return chart
+
+def run_tool(name: str, arguments: str, dataset_id: Optional[str] = None) -> str:
+    with span("tool", tool=name) as s:
+        result = _dispatch_tool(name, json.loads(arguments), dataset_id)
+        s.set(result_chars=len(result), failed=_is_tool_error(result))
+    return result
+
+def _dispatch_tool(name: str, args: dict, dataset_id: Optional[str] = None) -> str:
+    print(f"[TOOL] Calling {name} with args: {args}")
+
+    if name == "run_sql":
+        return safe_execute(args["query"], timeout=TOOL_TIMEOUT, dataset_id=dataset_id)
+    if name == "make_chart":
+        try:
+            return make_chart(args["result_id"], args.get("x"), args.get("y"))
+        except Exception as e:
+            return f"Chart error: {e}"
+    return "Unknown tool."
+
+def run_tool_calls(tool_calls, dataset_id: Optional[str] = None) -> list:
+    """Run one turn's tool calls concurrently; results come back in tool_calls order.
+
+    Each call gets TOOL_TIMEOUT from the moment a worker starts it, the same
+    clock safe_execute's SQL deadline uses, so time spent queued behind
+    TOOL_WORKERS does not count against it.
+    """
+    started = [None] * len(tool_calls)
+
+    def start(i: int, name: str, arguments: str) -> str:
+        started[i] = time.monotonic()
+        return run_tool(name, arguments, dataset_id)
+
+    futures = [
+        _tool_pool.submit(bind(start), i, t["function"]["name"], t["function"]["arguments"])
+        for i, t in enumerate(tool_calls)
+    ]
+    results = []
+    for i, (tool, future) in enumerate(zip(tool_calls, futures)):
+        name = tool["function"]["name"]
+        try:
+            while True:
+                wait = TOOL_TIMEOUT if started[i] is None else started[i] + TOOL_TIMEOUT - time.monotonic()
+                try:
+                    results.append(future.result(timeout=max(0.0, wait)))
+                    break
+                except FuturesTimeout:
+                    if started[i] is not None and time.monotonic() >= started[i] + TOOL_TIMEOUT:
+                        raise
+                    # Still queued behind other tools: keep waiting for a worker.
+        except FuturesTimeout:
+            print(f"[TOOL] {name} timed out after {TOOL_TIMEOUT:g}s")
+            results.append(f"Tool error: timed out after {TOOL_TIMEOUT:g}s.")
+        except Exception as e:
+            print(f"[TOOL] {name} failed: {e}")
+            results.append(f"Tool error: {e}")
+    return results
+
+@dataclass
+class AgentEvent:
+    kind: str  # "tool" (progress text), "token" (answer text delta), "image" (data URI) or "trace" (trace id)
+    content: str
+
+def _stream_completion(messages: list, tool_choice: str = "auto"):
+    """Yield token events as deltas arrive; return the assembled assistant message."""
+    with span("llm", model=MODEL, tool_choice=tool_choice, messages=len(messages)) as s:
+        msg = yield from _stream_deltas(messages, tool_choice, s)
+        s.set(tool_calls=len(msg.get("tool_calls", [])), answer_chars=len(msg["content"] or ""))
+    return msg
+
+def _stream_deltas(messages: list, tool_choice: str, s):
+    started = time.perf_counter()
+    stream = _openai().chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=tools,
+        tool_choice=tool_choice,
+        stream=True,
+        stream_options={"include_usage": True},
+        # temperature=0
+    )
+    content = []
+    calls = {}
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            s.set(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens)
+        if not chunk.choices:
+            continue
+        if "first_delta_ms" not in s.attrs:
+            s.set(first_delta_ms=round((time.perf_counter() - started) * 1000, 1))
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            yield AgentEvent("token", delta.content)
+        for part in delta.tool_calls or []:
+            call = calls.setdefault(
+                part.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if part.id:
+                call["id"] = part.id
+            if part.function and part.function.name:
+                call["function"]["name"] += part.function.name
+            if part.function and part.function.arguments:
+                call["function"]["arguments"] += part.function.arguments
+
+    msg = {"role": "assistant", "content": "".join(content) or None}
+    if calls:
+        msg["tool_calls"] = [calls[i] for i in sorted(calls)]
+    return msg
+
+def _is_tool_error(result: str) -> bool:
+    return result.startswith(TOOL_ERROR_PREFIXES)
+
+def _result_id(result: str):
+    match = re.match(r"result_id: (\S+)", result)
+    return match.group(1) if match else None
+
+def _replay_plan(plan: list, messages: list, dataset_id: Optional[str] = None):
+    """Re-run a cached plan's tool calls locally, appending them to `messages`.
+
+    make_chart calls refer to earlier run_sql calls as {"$ref": [turn, index]} and
+    are pointed at the fresh result handles. Returns "failed" (leaving `messages`
+    untouched) if any call fails on the current data, "answered" if the plan
+    ended in a chart that was yielded, else "replayed".
+    """
+    replayed = []
+    handles = {}
+    for turn_no, turn in enumerate(plan):
+        calls = []
+        for i, call in enumerate(turn):
+            args = json.loads(call["arguments"])
+            ref = args.get("result_id")
+            if isinstance(ref, dict):
+                args["result_id"] = handles.get(tuple(ref["$ref"]), "")
+            calls.append({
+                "id": f"plan_{turn_no}_{i}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(args)},
+            })
+        for call in calls:
+            yield AgentEvent("tool", f"Replaying cached `{call['function']['name']}`...")
+        results = run_tool_calls(calls, dataset_id)
+        if any(_is_tool_error(r) for r in results):
+            return "failed"
+        for i, (call, result) in enumerate(zip(calls, results)):
+            if call["function"]["name"] == "make_chart" and result.startswith("data:image/"):
+                yield AgentEvent("image", result)
+                return "answered"
+            handles[(turn_no, i)] = _result_id(result)
+        replayed.append({"role": "assistant", "content": None, "tool_calls": calls})
+        replayed.extend(
+            {"role": "tool", "tool_call_id": c["id"], "name": c["function"]["name"], "content": r}
+            for c, r in zip(calls, results)
+        )
+    messages.extend(replayed)
+    return "replayed"
+
+def _plan_step(tool_calls: list, handles: dict):
+    """Plan entry for one turn, with make_chart handles rewritten as references.
+
+    Returns None if a chart points at a result this question didn't produce.
+    """
+    step = []
+    for t in tool_calls:
+        arguments = t["function"]["arguments"]
+        if t["function"]["name"] == "make_chart":
+            args = json.loads(arguments)
+            if args.get("result_id") not in handles:
+                return None
+            args["result_id"] = {"$ref": handles[args["result_id"]]}
+            arguments = json.dumps(args)
+        step.append({"name": t["function"]["name"], "arguments": arguments})
+    return step
+
+def _final_answer(msg: dict):
+    answer = msg["content"] or "No answer."
+    if not msg["content"]:
+        yield AgentEvent("token", answer)
+    print(f"[AGENT] Final answer:\n{answer}")
+
+def stream_answer(user_question: str, dataset_id: Optional[str] = None):
+    """Run the agent loop, yielding AgentEvents as tools run and answer tokens arrive.
+
+    The first event carries the trace id under which the answer's spans are recorded.
+    """
+    with span("answer", question=user_question[:200], dataset_id=dataset_id) as s:
+        yield AgentEvent("trace", s.trace_id)
+        yield from _answer_events(user_question, dataset_id)
+
+def _answer_events(user_question: str, dataset_id: Optional[str] = None):
     print(f"\n[AGENT] Question: {user_question}")
-    print(TABLE_CONTEXT)
+    context = table_context(dataset_id)
+    print(context)
 
     messages = [
             {
@@ -67,7 +329,7 @@ def get_answer(user_question: str) -> str:
     NEVER write INSERT, UPDATE, DELETE, DROP, or CREATE.
     Only use SELECT queries.
 
-    {TABLE_CONTEXT}
+    {context}
 
     Answer in clear, natural English. If showing data, summarize it nicely.
     Use the tools when needed."""
@@ -75,74 +337,70 @@ def get_answer(user_question: str) -> str:
             {"role": "user", "content": user_question}
         ]
 
-    for _ in range(4):
-        response = openai.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            # temperature=0
-        )
-        msg = response.choices[0].message
-        messages.append(msg)
-
-        if not msg.tool_calls:
-            answer = msg.content or "No answer."
-            print(f"[AGENT] Final answer:\n{answer}")
-            return answer
-
-        for tool in msg.tool_calls:
-            name = tool.function.name
-            args = json.loads(tool.function.arguments)
+    try:
+        fingerprint = get_schema_fingerprint(dataset_id)
+    except Exception:
+        fingerprint = None
 
-            print(f"[TOOL] Calling {name} with args: {args}")
+    with span("plan_cache") as s:
+        cached_plan = _plans().get(user_question, fingerprint) if fingerprint else None
+        s.set(cache_hit=bool(cached_plan))
+    if cached_plan:
+        print(f"[AGENT] Plan cache hit: {cached_plan}")
+        outcome = yield from _replay_plan(cached_plan, messages, dataset_id)
+        if outcome == "answered":
+            return
+        if outcome == "replayed":
+            msg = yield from _stream_completion(messages, tool_choice="none")
+            yield from _final_answer(msg)
+            return
+        print("[AGENT] Cached plan failed on current data, discarding it")
+        _plans().discard(user_question, fingerprint)
 
-            if name == "run_sql":
-                result = safe_execute(args["query"])
-                print(f"[TOOL] {name} result:\n{result}")
-            elif name == "make_chart":
-                try:
-                    from io import StringIO
-                    table_str = args["markdown_table"].strip()
-
-                    df = pd.read_csv(StringIO(table_str), sep="|", skiprows=1, engine="python")
-                    df = df.dropna(axis=1, how='all')
-                    df = df.iloc[:-1]
-                    df.columns = [c.strip() for c in df.columns]
-
-                    num_col = df.select_dtypes(include="number").columns[0]
-                    cat_col = df.columns[0] if df.columns[0] != num_col else df.columns[1]
-
-                    import matplotlib.pyplot as plt
-                    plt.figure(figsize=(11, 6))
-                    bars = plt.bar(df[cat_col].astype(str), df[num_col], color="#1f77b4")
-                    plt.title(f"{num_col} by {cat_col}", fontsize=16, pad=20)
-                    plt.xlabel(cat_col, fontsize=12)
-                    plt.ylabel(num_col, fontsize=12)
-                    plt.xticks(rotation=45, ha="right")
-                    plt.grid(axis='y', alpha=0.3)
-                    plt.tight_layout()
-
-                    buf = BytesIO()
-                    plt.savefig(buf, format="png", dpi=150, bbox_inches="tight", facecolor="white")
-                    plt.close()
-                    img_b64 = base64.b64encode(buf.getvalue()).decode()
-
-                    result = f"data:image/png;base64,{img_b64}"
-
-                    print("[TOOL] make_chart → pure base64 image returned")
-                    return result
-                except Exception as e:
-                    result = f"Chart error: {e}"
-            else:
-                result = "Unknown tool."
+    plan = []
+    handles = {}
+    cacheable = fingerprint is not None
+    for turn_no in range(4):
+        msg = yield from _stream_completion(messages)
+        messages.append(msg)
 
+        if not msg.get("tool_calls"):
+            yield from _final_answer(msg)
+            if plan and cacheable:
+                _plans().put(user_question, fingerprint, plan)
+            return
 
+        for tool in msg["tool_calls"]:
+            yield AgentEvent("tool", f"Running `{tool['function']['name']}`...")
+        results = run_tool_calls(msg["tool_calls"], dataset_id)
+        step = _plan_step(msg["tool_calls"], handles)
+        if step is None or any(_is_tool_error(r) for r in results):
+            cacheable = False
+        else:
+            plan.append(step)
+        for i, (tool, result) in enumerate(zip(msg["tool_calls"], results)):
+            if tool["function"]["name"] == "make_chart" and result.startswith("data:image/"):
+                if cacheable:
+                    _plans().put(user_question, fingerprint, plan)
+                yield AgentEvent("image", result)
+                return
+            if _result_id(result):
+                handles[_result_id(result)] = [turn_no, i]
             messages.append({
                 "role": "tool",
-                "tool_call_id": tool.id,
-                "name": name,
+                "tool_call_id": tool["id"],
+                "name": tool["function"]["name"],
                 "content": result
             })
 
-    return "I couldn't answer in 4 steps. Try a simpler question."
\ No newline at end of file
+    yield AgentEvent("token", "I couldn't answer in 4 steps. Try a simpler question.")
+
+def get_answer(user_question: str, dataset_id: Optional[str] = None) -> str:
+    """Blocking variant of stream_answer: the full answer text, or a chart data URI."""
+    tokens = []
+    for event in stream_answer(user_question, dataset_id):
+        if event.kind == "image":
+            return event.content
+        if event.kind == "token":
+            tokens.append(event.content)
+    return "".join(tokens)
@@ -1,7 +1,13 @@
+import time
+import uuid
 import streamlit as st
-from db import init_db, save_uploaded_csv, create_and_load_table, get_stats
-from agent import get_answer
-from ticket import create_support_ticket
+from db import (
+    init_db, save_uploaded_csv, create_and_load_table, get_stats, get_profile,
+    upload_dataset_id, dataset_ready, list_sheets, get_index_report,
+)
+from agent import stream_answer
+from ticket import queue_support_ticket, get_ticket_status
+from telemetry import breakdown
 
 st.set_page_config(page_title="Chat with Your Data", layout="wide")
 st.title("Chat with Your CSV → Database")
@@ -9,18 +15,46 @@ st.title("Chat with Your CSV → Database")
 init_db()
 if "db_ready" not in st.session_state:
     st.session_state.db_ready = False
+if "dataset_id" not in st.session_state:
+    st.session_state.dataset_id = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# Another session's upload may have evicted this dataset to free disk space;
+# forget it so the file still in the uploader is loaded again below.
+if st.session_state.db_ready and not dataset_ready(st.session_state.dataset_id):
+    st.session_state.db_ready = False
+    st.session_state.last_file_id = None
 
 uploaded_file = st.file_uploader("Upload your data in CSV or XLSX", type=["csv", "xlsx"], key="csv_uploader")
 
 if uploaded_file is not None:
-    current_file_id = f"{uploaded_file.name}_{uploaded_file.size}"
+    sheet = None
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        sheets_key = (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get("sheets_key") != sheets_key:
+            st.session_state.sheets = list_sheets(uploaded_file)
+            st.session_state.sheets_key = sheets_key
+        sheets = st.session_state.sheets
+        sheet = st.selectbox("Sheet", sheets) if len(sheets) > 1 else sheets[0]
+
+    current_file_id = f"{uploaded_file.name}_{uploaded_file.size}_{sheet}"
     if st.session_state.get("last_file_id") != current_file_id:
         with st.spinner("Processing your data... (this happens only once)"):
             csv_path = save_uploaded_csv(uploaded_file)
-            create_and_load_table(csv_path)
+            dataset_id = upload_dataset_id(csv_path, sheet)
+            if not dataset_ready(dataset_id):
+                progress_bar = st.progress(0.0, text="Loading rows...")
+                create_and_load_table(
+                    csv_path,
+                    progress=lambda rows, fraction: progress_bar.progress(
+                        min(fraction, 1.0), text=f"Loaded {rows:,} rows"
+                    ),
+                    dataset_id=dataset_id,
+                    sheet=sheet,
+                )
+                progress_bar.empty()
             st.session_state.last_file_id = current_file_id
+            st.session_state.dataset_id = dataset_id
             st.session_state.db_ready = True
         st.success("Data loaded! You can now chat with your data.")
         st.rerun()
@@ -28,13 +62,79 @@ else:
     if st.session_state.db_ready:
         st.info("Your data is already loaded. Ready to chat!")
 
+TICKET_REPEAT_SECONDS = 10
+
+def submit_ticket(last_q: str, last_a: str, description: str = ""):
+    # Each report is a new ticket; the same report again within a few seconds
+    # is a double click and keeps its submission id, so one issue is filed.
+    report = (last_q, last_a, description)
+    previous = st.session_state.get("ticket_submission")
+    if previous and previous["report"] == report and time.time() - previous["at"] < TICKET_REPEAT_SECONDS:
+        submission_id = previous["id"]
+    else:
+        submission_id = uuid.uuid4().hex[:24]
+        st.session_state.ticket_submission = {"report": report, "id": submission_id, "at": time.time()}
+    try:
+        st.session_state.ticket_key = queue_support_ticket(last_q, last_a, description, submission_id)
+    except Exception as e:
+        st.error(str(e))
+
+def show_ticket_status():
+    key = st.session_state.get("ticket_key")
+    ticket = get_ticket_status(key) if key else None
+    if ticket is None:
+        return
+    if ticket["status"] == "created":
+        st.success(f"Support ticket created!\n{ticket['issue_url']}")
+    elif ticket["status"] == "failed":
+        st.error(f"Failed to create ticket: {ticket['last_error']}")
+    else:
+        retry = f" (attempt {ticket['attempts']} failed: {ticket['last_error']})" if ticket["attempts"] else ""
+        st.info(f"Support ticket queued{retry}. It will be filed in the background.")
+        st.button("Refresh ticket status", key="ticket_refresh")
+
 with st.sidebar:
     if st.session_state.db_ready:
-        stats = get_stats()
+        stats = get_stats(st.session_state.dataset_id)
         st.metric("Rows", f"{stats['rows']:,}")
         st.metric("Total (numeric)", f"{stats['revenue']:,.2f}" if stats['revenue'] else "N/A")
         st.write("Ask anything about your data!")
 
+        profile = get_profile(st.session_state.dataset_id)
+        if profile:
+            with st.expander("Column profile"):
+                st.dataframe(
+                    [
+                        {
+                            "column": c["column_name"],
+                            "type": c["sql_type"],
+                            "nulls": c["null_count"],
+                            "distinct≈": c["distinct_approx"],
+                            "min": c["min_value"],
+                            "max": c["max_value"],
+                        }
+                        for c in profile
+                    ],
+                    hide_index=True,
+                )
+
+        index_report = get_index_report(st.session_state.dataset_id)
+        if index_report["decisions"]:
+            with st.expander("Automatic indexes"):
+                st.dataframe(
+                    [
+                        {
+                            "column": d["column"],
+                            "action": d["action"],
+                            "before ms": d.get("before_ms"),
+                            "after ms": d.get("after_ms"),
+                            "detail": d["detail"],
+                        }
+                        for d in index_report["decisions"]
+                    ],
+                    hide_index=True,
+                )
+
         st.markdown("---")
         st.subheader("Support")
 
@@ -54,18 +154,47 @@ with st.sidebar:
                 "—"
             )
 
-            link = create_support_ticket(last_q, last_a, ticket_description)
-            st.success(link)
+            submit_ticket(last_q, last_a, ticket_description)
+
+        show_ticket_status()
     else:
         st.warning("Upload a CSV/XLSX to start")
 
 
-for msg in st.session_state.messages:
+def show_performance(trace_id: str):
+    rows = breakdown(trace_id)
+    if not rows:
+        return
+    with st.expander("Performance"):
+        llm = [r for r in rows if r["name"] == "llm"]
+        tokens = sum((r.get("prompt_tokens") or 0) + (r.get("completion_tokens") or 0) for r in llm)
+        st.caption(
+            f"Total {rows[0]['ms']:,.0f} ms · LLM {sum(r['ms'] for r in llm):,.0f} ms "
+            f"in {len(llm)} calls · {tokens:,} tokens"
+        )
+        st.dataframe(
+            [
+                {
+                    "stage": "\u2003" * r["depth"] + r["name"],
+                    "ms": r["ms"],
+                    "details": ", ".join(
+                        f"{k}={v}" for k, v in r.items()
+                        if k not in ("depth", "name", "ms") and v not in (None, "")
+                    ),
+                }
+                for r in rows
+            ],
+            hide_index=True,
+        )
+
+for i, msg in enumerate(st.session_state.messages):
     with st.chat_message(msg["role"]):
         if msg.get("type") == "image":
             st.image(msg["content"], width=700)
         else:
             st.markdown(msg["content"], unsafe_allow_html=True)
+        if msg.get("trace_id") and i == len(st.session_state.messages) - 1:
+            show_performance(msg["trace_id"])
 
 if st.session_state.db_ready and (prompt := st.chat_input("Ask about your data...")):
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -73,29 +202,47 @@ if st.session_state.db_ready and (prompt := st.chat_input("Ask about your data..
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            answer = get_answer(prompt)
+        status = st.status("Thinking...", expanded=False)
+        chart = {}
+        trace = {}
+
+        def answer_tokens():
+            for event in stream_answer(prompt, st.session_state.dataset_id):
+                if event.kind == "tool":
+                    status.write(event.content)
+                elif event.kind == "image":
+                    chart["image"] = event.content
+                elif event.kind == "trace":
+                    trace["id"] = event.content
+                else:
+                    yield event.content
 
-        if answer.strip().startswith("data:image/png;base64,"):
+        answer = st.write_stream(answer_tokens()) or ""
+        status.update(label="Done", state="complete")
+
+        if "image" in chart:
+            answer = chart["image"]
             st.image(answer, width=700)
-        else:
-            st.markdown(answer, unsafe_allow_html=True)
+        if "id" in trace:
+            show_performance(trace["id"])
     
-    if answer.strip().startswith("data:image/png;base64,"):
+    if answer.strip().startswith("data:image/"):
         st.session_state.messages.append({
             "role": "assistant",
             "type": "image",
-            "content": answer
+            "content": answer,
+            "trace_id": trace.get("id"),
         })
     else:
         st.session_state.messages.append({
             "role": "assistant",
             "type": "text",
-            "content": answer
+            "content": answer,
+            "trace_id": trace.get("id"),
         })
 
 if st.session_state.db_ready and st.button("Create Support Ticket"):
     last_q = next((m["content"] for m in reversed(st.session_state.messages) if m["role"] == "user"), "—")
     last_a = next((m["content"] for m in reversed(st.session_state.messages) if m["role"] == "assistant"), "—")
-    link = create_support_ticket(last_q, last_a)
-    st.success(link)
\ No newline at end of file
+    submit_ticket(last_q, last_a)
+    show_ticket_status()
\ No newline at end of file
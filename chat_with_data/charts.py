@@ -0,0 +1,58 @@
+import base64
+import os
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png").lower()  # "png" or "webp"
+CHART_DPI = int(os.getenv("CHART_DPI", "100"))
+CHART_SIZE = (float(os.getenv("CHART_WIDTH", "11")), float(os.getenv("CHART_HEIGHT", "6")))
+
+
+def pick_columns(df: "pd.DataFrame", x: Optional[str] = None, y: Optional[str] = None):
+    """Default to the first numeric column for values and the first other column for labels."""
+    if y is None:
+        numeric = df.select_dtypes(include="number").columns
+        if numeric.empty:
+            raise ValueError("result has no numeric column to plot")
+        y = numeric[0]
+    if x is None:
+        x = next((c for c in df.columns if c != y), None)
+        if x is None:
+            raise ValueError("result needs a label column besides the values")
+    for col in (x, y):
+        if col not in df.columns:
+            raise ValueError(f"unknown column {col!r}; available: {list(df.columns)}")
+    return x, y
+
+
+def render_bar_chart(df: "pd.DataFrame", x: Optional[str] = None, y: Optional[str] = None,
+                     fmt: str = CHART_FORMAT, dpi: int = CHART_DPI) -> str:
+    """Render a bar chart to a data URI.
+
+    Uses a standalone Figure on the Agg canvas rather than pyplot, so there is no
+    global figure state and charts can render concurrently.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    x, y = pick_columns(df, x, y)
+
+    fig = Figure(figsize=CHART_SIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.bar(df[x].astype(str), df[y], color="#1f77b4")
+    ax.set_title(f"{y} by {x}", fontsize=16, pad=20)
+    ax.set_xlabel(x, fontsize=12)
+    ax.set_ylabel(y, fontsize=12)
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment("right")
+    ax.grid(axis="y", alpha=0.3)
+    fig.tight_layout()
+
+    buf = BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches="tight", facecolor="white")
+    return f"data:image/{fmt};base64,{base64.b64encode(buf.getvalue()).decode()}"
@@ -0,0 +1,128 @@
+import json
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from schema import quote_ident, is_numeric_type
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PROFILE_TABLE = "user_data_profile"
+KMV_SIZE = 1024      # hashes kept per column for the distinct-count sketch
+TOPK_CAPACITY = 256  # candidate values tracked per column for top-k
+TOPK_REPORTED = 5
+
+PROFILE_COLUMNS = [
+    "position", "column_name", "sql_type", "row_count", "null_count",
+    "min_value", "max_value", "sum_value", "distinct_approx", "top_values",
+]
+
+
+class _ColumnState:
+    def __init__(self, name: str, sql_type: str):
+        self.name = name
+        self.sql_type = sql_type
+        self.numeric = is_numeric_type(sql_type)
+        self.integer = "INT" in sql_type.upper()
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.sum = 0 if self.numeric else None
+        self.hashes = None
+        self.counts = Counter()
+
+    def update(self, series: "pd.Series"):
+        import numpy as np
+        import pandas as pd
+
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+
+        if self.numeric:
+            numbers = pd.to_numeric(values, errors="coerce").dropna()
+            if not numbers.empty:
+                self.sum += numbers.sum().item()
+                self._extend(numbers.min().item(), numbers.max().item())
+            keyed = numbers.astype("float64")
+        else:
+            keyed = values.astype(str)
+            self._extend(keyed.min(), keyed.max())
+
+        # KMV sketch: keep the KMV_SIZE smallest distinct 64-bit hashes seen so far.
+        hashes = pd.util.hash_pandas_object(keyed, index=False).to_numpy()
+        if self.hashes is not None:
+            hashes = np.concatenate([self.hashes, hashes])
+        self.hashes = np.unique(hashes)[:KMV_SIZE]
+
+        # Heavy-hitter summary: merge the chunk's most frequent values, keep the top candidates.
+        self.counts.update(keyed.value_counts().head(TOPK_CAPACITY).to_dict())
+        if len(self.counts) > TOPK_CAPACITY:
+            self.counts = Counter(dict(self.counts.most_common(TOPK_CAPACITY)))
+
+    def _extend(self, low, high):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def tidy(self, value):
+        """Integer columns with gaps are read as float; report their stats as ints."""
+        if self.integer and isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def distinct(self) -> int:
+        if self.hashes is None:
+            return 0
+        if len(self.hashes) < KMV_SIZE:
+            return len(self.hashes)
+        return int((KMV_SIZE - 1) * 2.0 ** 64 / float(self.hashes[-1]))
+
+
+class ColumnProfiler:
+    """Single-pass per-column statistics accumulated chunk by chunk during ingest.
+
+    Row/null counts, min/max and sum are exact; distinct counts (KMV sketch) and
+    top values (bounded heavy-hitter summary) are approximate.
+    """
+
+    def __init__(self, columns: list, sql_types: dict):
+        self.rows = 0
+        self._states = [_ColumnState(str(c), sql_types.get(str(c).lower(), "TEXT")) for c in columns]
+
+    def update(self, chunk: "pd.DataFrame"):
+        self.rows += len(chunk)
+        for state, col in zip(self._states, chunk.columns):
+            state.update(chunk[col])
+
+    def records(self) -> list:
+        return [
+            (
+                position, s.name, s.sql_type, self.rows, s.nulls,
+                s.tidy(s.min), s.tidy(s.max), s.tidy(s.sum), s.distinct(),
+                json.dumps([[s.tidy(v), n] for v, n in s.counts.most_common(TOPK_REPORTED)]),
+            )
+            for position, s in enumerate(self._states)
+        ]
+
+    def save(self, conn):
+        """Replace the profile table; runs inside the ingest transaction."""
+        table = quote_ident(PROFILE_TABLE)
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(
+            f"CREATE TABLE {table} (position INTEGER, column_name TEXT, sql_type TEXT, "
+            "row_count INTEGER, null_count INTEGER, min_value, max_value, sum_value, "
+            "distinct_approx INTEGER, top_values TEXT)"
+        )
+        marks = ", ".join("?" for _ in PROFILE_COLUMNS)
+        conn.executemany(f"INSERT INTO {table} VALUES ({marks})", self.records())
+
+
+def load_profile(conn) -> list:
+    """Profile rows as dicts, ordered like the table columns."""
+    cur = conn.execute(f"SELECT * FROM {quote_ident(PROFILE_TABLE)} ORDER BY position")
+    names = [d[0] for d in cur.description]
+    profile = [dict(zip(names, row)) for row in cur.fetchall()]
+    for col in profile:
+        col["top_values"] = json.loads(col["top_values"])
+    return profile
@@ -0,0 +1,569 @@
+"""Columnar sidecar of `user_data` for aggregation queries.
+
+Ingest can additionally write the table as an Arrow IPC file next to the
+dataset's database. Aggregation queries in a small supported subset
+
+    SELECT <group columns and aggregates> FROM user_data
+    [WHERE <col op literal> AND ...] [GROUP BY <cols>]
+    [ORDER BY <output or group column> [ASC|DESC], ...] [LIMIT n [OFFSET m]]
+
+are answered from the memory-mapped columns with vectorized scans. `query`
+returns None whenever a query or a column falls outside what can be answered
+exactly as SQLite would, and the caller runs the query in SQLite instead.
+"""
+import re
+import sqlite3
+import threading
+from typing import Optional
+
+from schema import quote_ident
+
+SIDECAR_SUFFIX = ".arrow"
+EXPORT_BATCH_ROWS = 65536
+AGGREGATES = {"count", "sum", "avg", "min", "max"}
+COMPARISONS = {"=", "==", "!=", "<>", "<", "<=", ">", ">="}
+# Before 3.43 SQLite sums REAL values naively in scan order, which np.bincount
+# reproduces bit for bit; later versions use compensated summation.
+SEQUENTIAL_FLOAT_SUM = sqlite3.sqlite_version_info < (3, 43, 0)
+# Integer sums are computed in float64, which is exact below 2**53.
+EXACT_FLOAT_INT = 2 ** 53
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<ident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|[A-Za-z_][A-Za-z0-9_$]*)
+      | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<op><=|>=|<>|!=|==|[=<>(),*;-])
+    )""",
+    re.VERBOSE,
+)
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class Unsupported(Exception):
+    """The query is outside the subset the columnar engine answers."""
+
+
+def sidecar_path(db_path) -> str:
+    return f"{db_path}{SIDECAR_SUFFIX}"
+
+
+def _affinity(declared: str) -> str:
+    """SQLite column affinity of a declared type."""
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return "INTEGER"
+    if any(t in declared for t in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not declared or "BLOB" in declared:
+        return "BLOB"
+    if any(t in declared for t in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def write_sidecar(conn: sqlite3.Connection, path: str, version: int) -> list:
+    """Export `user_data` to an Arrow IPC file, batch by batch.
+
+    Each column is stored only if all its values share one storage class
+    (INTEGER, REAL or TEXT); mixed columns are left out, and queries that touch
+    them run in SQLite. Returns the names of the exported columns.
+    """
+    import pyarrow as pa
+
+    declared = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info(user_data)")]
+    probes = ", ".join(
+        f"MAX(typeof({quote_ident(name)}) = '{kind}')"
+        for name, _ in declared for kind in ("integer", "real", "text", "blob")
+    )
+    flags = conn.execute(f"SELECT {probes} FROM user_data").fetchone()
+
+    fields = []
+    for i, (name, sql_type) in enumerate(declared):
+        has_int, has_real, has_text, has_blob = (bool(f) for f in flags[4 * i:4 * i + 4])
+        kinds = [t for t, present in (
+            (pa.int64(), has_int), (pa.float64(), has_real), (pa.string(), has_text), (None, has_blob)
+        ) if present]
+        if len(kinds) == 1 and kinds[0] is not None:
+            fields.append(pa.field(name, kinds[0], metadata={"sql_type": sql_type or ""}))
+
+    schema = pa.schema(fields, metadata={"user_version": str(version)})
+    columns = ", ".join(quote_ident(f.name) for f in fields) or "NULL"
+    cur = conn.execute(f"SELECT {columns} FROM user_data ORDER BY rowid")
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        while rows := cur.fetchmany(EXPORT_BATCH_ROWS):
+            values = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values[i], type=f.type) for i, f in enumerate(fields)], schema=schema
+            ))
+    cur.close()
+    return [f.name for f in fields]
+
+
+def _load(path: str, version: int):
+    """Memory-mapped table for `path`, or None if it is missing or from another version."""
+    import os
+
+    import pyarrow as pa
+
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _tables_lock:
+        cached = _tables.get(path)
+        if cached is None or cached[0] != stamp:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            cached = _tables[path] = (stamp, table)
+    table = cached[1]
+    if int((table.schema.metadata or {}).get(b"user_version", -1)) != version:
+        return None
+    return table
+
+
+def forget(path: str):
+    """Drop the cached mapping of a sidecar that is being replaced or deleted."""
+    with _tables_lock:
+        _tables.pop(path, None)
+
+
+# --- parsing ------------------------------------------------------------------
+
+def _tokenize(sql: str) -> list:
+    """(kind, value, start, end) tuples; anything unrecognised is unsupported."""
+    tokens, pos = [], 0
+    sql = sql.rstrip()
+    while pos < len(sql):
+        m = _TOKEN.match(sql, pos)
+        if m is None or m.end() == pos:
+            raise Unsupported(f"unexpected input at {pos}")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind), m.start(kind), m.end(kind)))
+        pos = m.end()
+    return tokens
+
+
+def _unquote(ident: str) -> str:
+    if ident[0] == '"':
+        return ident[1:-1].replace('""', '"')
+    if ident[0] in "`[":
+        return ident[1:-1]
+    return ident
+
+
+class _Parser:
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = _tokenize(sql)
+        self.pos = 0
+
+    def peek(self, offset: int = 0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else ("end", "", len(self.sql), len(self.sql))
+
+    def keyword(self, *words) -> bool:
+        kind, value, _, _ = self.peek()
+        if kind == "ident" and value.upper() in words:
+            self.pos += 1
+            return True
+        return False
+
+    def expect_keyword(self, word: str):
+        if not self.keyword(word):
+            raise Unsupported(f"expected {word}")
+
+    def op(self, *ops) -> Optional[str]:
+        kind, value, _, _ = self.peek()
+        if kind == "op" and value in ops:
+            self.pos += 1
+            return value
+        return None
+
+    def ident(self) -> str:
+        kind, value, _, _ = self.peek()
+        if kind != "ident":
+            raise Unsupported("expected a column name")
+        self.pos += 1
+        return _unquote(value)
+
+    def literal(self):
+        sign = -1 if self.op("-") else 1
+        kind, value, _, _ = self.peek()
+        self.pos += 1
+        if kind == "number":
+            number = float(value) if re.search(r"[.eE]", value) else int(value)
+            return sign * number
+        if kind == "string" and sign == 1:
+            return value[1:-1].replace("''", "'")
+        if kind == "ident" and value.upper() == "NULL" and sign == 1:
+            raise Unsupported("comparison with NULL")
+        raise Unsupported("expected a literal")
+
+    def item(self) -> dict:
+        """A select item: a column or an aggregate over a column or *."""
+        start = self.peek()[2]
+        kind, value, _, _ = self.peek()
+        if kind == "ident" and value.lower() in AGGREGATES and self.peek(1)[1] == "(":
+            self.pos += 2
+            func = value.lower()
+            distinct = self.keyword("DISTINCT")
+            if self.op("*"):
+                if func != "count" or distinct:
+                    raise Unsupported(f"{func}(*)")
+                column = None
+            else:
+                column = self.ident()
+            if not self.op(")"):
+                raise Unsupported("aggregate over an expression")
+            if distinct and func != "count":
+                raise Unsupported(f"{func}(DISTINCT ...)")
+            item = {"func": "count_distinct" if distinct else func, "column": column}
+        else:
+            item = {"func": None, "column": self.ident()}
+        item["text"] = self.sql[start:self.tokens[self.pos - 1][3]]
+        return item
+
+    def alias(self) -> Optional[str]:
+        if self.keyword("AS"):
+            return self.ident()
+        kind, value, _, _ = self.peek()
+        if kind == "ident" and value.upper() not in ("FROM", "WHERE", "GROUP", "ORDER", "LIMIT"):
+            return self.ident()
+        return None
+
+    def condition(self) -> tuple:
+        column = self.ident()
+        if self.keyword("IS"):
+            negate = self.keyword("NOT")
+            self.expect_keyword("NULL")
+            return (column, "is not null" if negate else "is null", None)
+        if self.keyword("IN"):
+            if not self.op("("):
+                raise Unsupported("IN without a value list")
+            values = [self.literal()]
+            while self.op(","):
+                values.append(self.literal())
+            if not self.op(")"):
+                raise Unsupported("IN subquery")
+            return (column, "in", values)
+        op = self.op(*COMPARISONS)
+        if op is None:
+            raise Unsupported("unsupported predicate")
+        return (column, op, self.literal())
+
+    def parse(self) -> dict:
+        self.expect_keyword("SELECT")
+        if self.keyword("DISTINCT", "ALL"):
+            raise Unsupported("SELECT DISTINCT")
+        items = []
+        while True:
+            item = self.item()
+            item["alias"] = self.alias()
+            items.append(item)
+            if not self.op(","):
+                break
+        self.expect_keyword("FROM")
+        if self.ident().lower() != "user_data":
+            raise Unsupported("only user_data is supported")
+
+        where = []
+        if self.keyword("WHERE"):
+            where.append(self.condition())
+            while self.keyword("AND"):
+                where.append(self.condition())
+
+        group_by = []
+        if self.keyword("GROUP"):
+            self.expect_keyword("BY")
+            group_by.append(self.ident())
+            while self.op(","):
+                group_by.append(self.ident())
+
+        order_by = []
+        if self.keyword("ORDER"):
+            self.expect_keyword("BY")
+            while True:
+                if self.peek()[0] == "number":
+                    term = int(self.literal())
+                else:
+                    term = self.item()
+                descending = self.keyword("DESC")
+                if not descending:
+                    self.keyword("ASC")
+                order_by.append((term, descending))
+                if not self.op(","):
+                    break
+
+        limit, offset = None, 0
+        if self.keyword("LIMIT"):
+            limit = self.literal()
+            if self.keyword("OFFSET"):
+                offset = self.literal()
+            if not isinstance(limit, int) or not isinstance(offset, int):
+                raise Unsupported("non-integer LIMIT")
+
+        self.op(";")
+        if self.peek()[0] != "end":
+            raise Unsupported("trailing input")
+        return {"items": items, "where": where, "group_by": group_by,
+                "order_by": order_by, "limit": limit, "offset": max(offset, 0)}
+
+
+# --- execution ----------------------------------------------------------------
+
+class _Columns:
+    """Case-insensitive column lookup on the sidecar schema."""
+
+    def __init__(self, table):
+        self.table = table
+        self.fields = {f.name.lower(): f for f in table.schema}
+
+    def field(self, name: str):
+        f = self.fields.get(name.lower())
+        if f is None:
+            raise Unsupported(f"column {name!r} is not in the sidecar")
+        return f
+
+    def affinity(self, name: str) -> str:
+        return _affinity(self.field(name).metadata.get(b"sql_type", b"").decode())
+
+
+def _coerce_literal(cols: _Columns, column: str, value):
+    """The literal as SQLite would compare it against `column`, or Unsupported."""
+    import pyarrow as pa
+
+    kind = cols.field(column).type
+    if isinstance(value, str):
+        if pa.types.is_string(kind) and cols.affinity(column) in ("TEXT", "BLOB"):
+            return value
+        if pa.types.is_string(kind):
+            # Numeric affinity turns a number-like literal into a number.
+            try:
+                float(value)
+            except ValueError:
+                return value
+        raise Unsupported("text literal against a numeric column")
+    if pa.types.is_string(kind):
+        raise Unsupported("numeric literal against a text column")
+    return value
+
+
+def _compare(cols: _Columns, column: str, arr, op: str, value):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if op == "in":
+        values = [_coerce_literal(cols, column, v) for v in value]
+        return pc.is_in(arr, value_set=pa.array(values, type=arr.type))
+    scalar = _coerce_literal(cols, column, value)
+    if isinstance(scalar, float) and pa.types.is_integer(arr.type):
+        arr = pc.cast(arr, pa.float64())
+    func = {"=": "equal", "==": "equal", "!=": "not_equal", "<>": "not_equal",
+            "<": "less", "<=": "less_equal", ">": "greater", ">=": "greater_equal"}[op]
+    return getattr(pc, func)(arr, scalar)
+
+
+def _filter_mask(cols: _Columns, where: list):
+    import pyarrow.compute as pc
+
+    mask = None
+    for column, op, value in where:
+        arr = cols.table[cols.field(column).name]
+        if op == "is null":
+            cond = pc.is_null(arr)
+        elif op == "is not null":
+            cond = pc.is_valid(arr)
+        else:
+            try:
+                cond = _compare(cols, column, arr, op, value)
+            except (TypeError, OverflowError, ValueError) as e:
+                # e.g. an integer literal beyond int64, which SQLite still compares.
+                raise Unsupported(f"literal not representable in Arrow: {e}")
+        mask = cond if mask is None else pc.and_kleene(mask, cond)
+    return mask
+
+
+def _group_ids(table, keys: list):
+    """(row → group id array, number of groups, key values per group)."""
+    import numpy as np
+    import pyarrow.compute as pc
+
+    if not keys:
+        return np.zeros(table.num_rows, dtype=np.int64), 1, [()]
+
+    codes, dictionaries = [], []
+    for key in keys:
+        encoded = pc.dictionary_encode(table[key].combine_chunks())
+        values = encoded.dictionary.to_pylist()
+        indices = encoded.indices
+        if indices.null_count:
+            indices = pc.fill_null(indices, len(values))
+            values.append(None)
+        codes.append(indices.to_numpy(zero_copy_only=False).astype(np.int64))
+        dictionaries.append(values)
+
+    if len(keys) == 1:
+        values = dictionaries[0]
+        return codes[0], len(values), [(v,) for v in values]
+
+    combined = np.zeros(table.num_rows, dtype=np.int64)
+    span = 1
+    for code, values in zip(codes, dictionaries):
+        span *= len(values)
+        if span >= 2 ** 62:
+            raise Unsupported("too many key combinations")
+        combined = combined * len(values) + code
+    _, first, ids = np.unique(combined, return_index=True, return_inverse=True)
+    groups = [tuple(values[code[i]] for code, values in zip(codes, dictionaries)) for i in first]
+    return ids.reshape(-1), len(groups), groups
+
+
+def _aggregate(table, item: dict, ids, n_groups: int) -> list:
+    """One aggregate per group, with SQLite's result types and NULL rules."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    func, column = item["func"], item["column"]
+    if column is None:
+        return np.bincount(ids, minlength=n_groups).tolist()
+
+    arr = table[column].combine_chunks()
+    valid = arr.is_valid().to_numpy(zero_copy_only=False)
+    counts = np.bincount(ids[valid], minlength=n_groups)
+    if func == "count":
+        return counts.tolist()
+
+    if func in ("min", "max", "count_distinct"):
+        grouped = pa.table({"g": pa.array(ids), "v": arr}).group_by("g").aggregate([("v", func)])
+        out = [0 if func == "count_distinct" else None] * n_groups
+        for g, value in zip(grouped["g"].to_pylist(), grouped[f"v_{func}"].to_pylist()):
+            out[g] = value
+        return out
+
+    if pa.types.is_string(arr.type):
+        raise Unsupported(f"{func} over a text column")
+    values = pc.fill_null(arr, 0).to_numpy(zero_copy_only=False)[valid]
+    integer = pa.types.is_integer(arr.type)
+    if integer:
+        if values.size and int(np.abs(values).max()) * values.size >= EXACT_FLOAT_INT:
+            raise Unsupported("integer sum may exceed exact float range")
+    elif not SEQUENTIAL_FLOAT_SUM:
+        raise Unsupported("this SQLite sums REAL values with compensation")
+    sums = np.bincount(ids[valid], weights=values.astype(np.float64), minlength=n_groups)
+
+    out = []
+    for total, count in zip(sums.tolist(), counts.tolist()):
+        if count == 0:
+            out.append(None)
+        elif func == "avg":
+            out.append(total / count)
+        else:
+            out.append(int(total) if integer else total)
+    return out
+
+
+def _sort_key(value):
+    # SQLite orders NULL before any value; each sidecar column has a single type.
+    return (0, 0) if value is None else (1, value)
+
+
+def _order_rows(rows: list, terms: list, unique: bool) -> list:
+    """Stable multi-key sort with SQLite's NULL placement; ties must not be possible
+    to reorder, so unresolved ties are Unsupported unless the keys are unique."""
+    for position, descending in reversed(terms):
+        rows.sort(key=lambda r: _sort_key(r[position]), reverse=descending)
+    if not unique:
+        keys = [tuple(r[p] for p, _ in terms) for r in rows]
+        if len(set(keys)) != len(keys):
+            raise Unsupported("ORDER BY leaves ties whose order SQLite does not define")
+    return rows
+
+
+def _execute(table, plan: dict):
+    import pyarrow as pa
+
+    cols = _Columns(table)
+    items, group_by = plan["items"], [cols.field(c).name for c in plan["group_by"]]
+    if not group_by and not any(i["func"] for i in items):
+        raise Unsupported("not an aggregation")
+    for item in items:
+        if item["column"] is not None:
+            item["column"] = cols.field(item["column"]).name
+        if item["func"] is None and item["column"] not in group_by:
+            raise Unsupported("bare column outside GROUP BY")
+
+    # Output columns, then hidden ones that only ORDER BY needs.
+    outputs = list(items)
+    terms = []
+    for term, descending in plan["order_by"]:
+        if isinstance(term, int):
+            if not 1 <= term <= len(items):
+                raise Unsupported("ORDER BY position out of range")
+            terms.append((term - 1, descending))
+            continue
+        if term["func"] is None:
+            match = next((i for i, it in enumerate(items)
+                          if it["alias"] and it["alias"].lower() == term["column"].lower()), None)
+            if match is not None:
+                terms.append((match, descending))
+                continue
+            term["column"] = cols.field(term["column"]).name
+            if term["column"] not in group_by:
+                raise Unsupported("ORDER BY column outside GROUP BY")
+        else:
+            if term["column"] is not None:
+                term["column"] = cols.field(term["column"]).name
+        match = next((i for i, it in enumerate(outputs)
+                      if (it["func"], it["column"]) == (term["func"], term["column"])), None)
+        if match is None:
+            outputs.append(term)
+            match = len(outputs) - 1
+        terms.append((match, descending))
+
+    needed = sorted(set(group_by) | {o["column"] for o in outputs if o["column"]}
+                    | {cols.field(c).name for c, _, _ in plan["where"]})
+    data = table.select(needed) if needed else pa.table({"_": pa.nulls(table.num_rows)})
+    mask = _filter_mask(cols, plan["where"])
+    if mask is not None:
+        data = data.filter(mask)
+
+    ids, n_groups, groups = _group_ids(data, group_by)
+    columns = []
+    for output in outputs:
+        if output["func"] is None:
+            k = group_by.index(output["column"])
+            columns.append([g[k] for g in groups])
+        else:
+            columns.append(_aggregate(data, output, ids, n_groups))
+    rows = [list(r) for r in zip(*columns)]
+    if group_by:
+        # Group keys go after the outputs; without ORDER BY, SQLite emits groups in key order.
+        rows = [r + list(g) for r, g in zip(rows, groups)]
+        if terms:
+            ordered = {outputs[p]["column"] for p, _ in terms if outputs[p]["func"] is None}
+            rows = _order_rows(rows, terms, unique=set(group_by) <= ordered)
+        else:
+            key_terms = [(len(outputs) + k, False) for k in range(len(group_by))]
+            rows = _order_rows(rows, key_terms, unique=True)
+
+    offset, limit = plan["offset"], plan["limit"]
+    rows = rows[offset:] if limit is None or limit < 0 else rows[offset:offset + limit]
+    names = [it["alias"] or (it["column"] if it["func"] is None else it["text"]) for it in items]
+    return names, [tuple(r[:len(items)]) for r in rows]
+
+
+def query(path: str, version: int, sql: str):
+    """(columns, rows) for `sql` answered from the sidecar, or None to use SQLite."""
+    import pyarrow as pa
+
+    table = _load(path, version)
+    if table is None:
+        return None
+    try:
+        return _execute(table, _Parser(sql).parse())
+    except (Unsupported, pa.ArrowException):
+        return None
@@ -1,36 +1,276 @@
 import sqlite3
-import pandas as pd
+import datetime
+import hashlib
+import itertools
+from collections import Counter, deque
+import json
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
 import os
+import re
 from pathlib import Path
 import uuid
 
 from dotenv import load_dotenv
+from schema import infer_schema, build_create_table_sql, quote_ident, is_numeric_type
+from cache import LRUCache, normalize_sql
+from column_profile import ColumnProfiler, load_profile
+import columnar
+from telemetry import span
+from encoding import encode_result, estimate_tokens
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 load_dotenv()
 
 llm_model = os.getenv("LLM_MODEL", "gpt-4o-mini")
+SCHEMA_INFERENCE = os.getenv("SCHEMA_INFERENCE", "local")  # "local" or "llm"
 UPLOAD_DIR = Path("data/user_uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 DB_PATH = Path("data/user_data.db")
+DATASET_DIR = Path("data/datasets")
+DATASET_MAX_BYTES = int(os.getenv("DATASET_MAX_MB", "2048")) * 1024 * 1024
+DATASET_MAX_AGE = int(os.getenv("DATASET_MAX_AGE", str(24 * 3600)))
+DATASET_EVICT_GRACE = int(os.getenv("DATASET_EVICT_GRACE", "900"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "2048")) * 1024 * 1024
+UPLOAD_COPY_BYTES = 1024 * 1024
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+LOAD_CACHE_KIB = int(os.getenv("INGEST_CACHE_KIB", "65536"))
+COLUMNAR_SIDECAR = os.getenv("COLUMNAR_SIDECAR", "0") == "1"
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "8"))
+READ_CACHE_KIB = int(os.getenv("READ_CACHE_KIB", "32768"))
+READ_MMAP_BYTES = int(os.getenv("READ_MMAP_BYTES", str(256 * 1024 * 1024)))
+READ_STATEMENT_CACHE = 256
+PREVIEW_ROWS = 10
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "1000"))
+FETCH_BATCH = 1000
+COUNT_BUDGET_OPS = int(os.getenv("COUNT_BUDGET_OPS", "5000000"))
+RESULT_CACHE = LRUCache(int(os.getenv("RESULT_CACHE_MB", "64")) * 1024 * 1024)
+RESULT_HANDLES = LRUCache(int(os.getenv("RESULT_HANDLES_MB", "32")) * 1024 * 1024)
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR", "1") == "1"
+INDEX_MIN_SCANS = int(os.getenv("INDEX_MIN_SCANS", "3"))
+INDEX_MAX_BYTES = int(os.getenv("INDEX_MAX_MB", "256")) * 1024 * 1024
+INDEX_MIN_SPEEDUP = float(os.getenv("INDEX_MIN_SPEEDUP", "1.25"))
+INDEX_TIMING_RUNS = 3
+INDEX_TIMING_BUDGET = 30.0
+QUERY_LOG_SIZE = 200
 
 def init_db():
-    if not DB_PATH.exists():
-        conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        # WAL is persistent in the file, so readers never block on ingest.
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
         conn.close()
 
+class ReadPool:
+    """Thread-safe pool of long-lived read-only connections to one database file.
+
+    Connections are opened on demand and up to `size` idle ones are kept for reuse.
+    `in_use` counts the connections currently borrowed.
+    """
+
+    def __init__(self, path: Path, size: int = READ_POOL_SIZE):
+        self.uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.uri, uri=True, check_same_thread=False, cached_statements=READ_STATEMENT_CACHE
+        )
+        conn.execute(f"PRAGMA cache_size=-{READ_CACHE_KIB}")
+        conn.execute(f"PRAGMA mmap_size={READ_MMAP_BYTES}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_read_pools = {}
+_read_pools_lock = threading.Lock()
+_last_access = {}
+
+def new_dataset_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+def dataset_path(dataset_id: Optional[str] = None) -> Path:
+    """Database file for a dataset; None means the legacy shared data/user_data.db."""
+    if dataset_id is None:
+        return DB_PATH
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", dataset_id):
+        raise ValueError(f"Invalid dataset id: {dataset_id!r}")
+    return DATASET_DIR / f"{dataset_id}.db"
+
+def read_connection(dataset_id: Optional[str] = None):
+    """Borrow a pooled read-only connection: `with read_connection() as conn: ...`"""
+    key = dataset_path(dataset_id).resolve()
+    with _read_pools_lock:
+        pool = _read_pools.get(key)
+        if pool is None:
+            pool = _read_pools[key] = ReadPool(key)
+        _last_access[key] = time.time()
+    return pool.connection()
+
+def _in_use(path: Path) -> bool:
+    with _read_pools_lock:
+        pool = _read_pools.get(path)
+    return pool is not None and pool.in_use > 0
+
+def _close_pool(path: Path):
+    with _read_pools_lock:
+        pool = _read_pools.pop(path, None)
+        _last_access.pop(path, None)
+    if pool is not None:
+        pool.close()
+
+WAL_SUFFIXES = ("-wal", "-shm")
+
+def _remove_wal_files(path: Path):
+    for suffix in WAL_SUFFIXES:
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+def _remove_db_files(path: Path):
+    columnar.forget(columnar.sidecar_path(path))
+    for suffix in ("", columnar.SIDECAR_SUFFIX):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    _remove_wal_files(path)
+
+def _drop_dataset(path: Path):
+    _close_pool(path)
+    _remove_db_files(path)
+
+def evict_datasets(keep: Optional[str] = None):
+    """Drop per-session datasets idle for DATASET_MAX_AGE, then least recently used
+    ones until the total fits DATASET_MAX_BYTES. The dataset `keep`, datasets used
+    in the last DATASET_EVICT_GRACE seconds and datasets with a query running are
+    never evicted, so the total may stay above the limit while sessions are active.
+    """
+    keep_path = dataset_path(keep).resolve() if keep else None
+    now = time.time()
+    datasets = []
+    for path in DATASET_DIR.glob("*.db"):
+        path = path.resolve()
+        if path == keep_path:
+            continue
+        size = sum(Path(f"{path}{s}").stat().st_size
+                   for s in ("", "-wal", columnar.SIDECAR_SUFFIX) if Path(f"{path}{s}").exists())
+        datasets.append((max(_last_access.get(path, 0), path.stat().st_mtime), size, path))
+
+    datasets.sort()
+    total = sum(size for _, size, _ in datasets)
+    if keep_path and keep_path.exists():
+        total += keep_path.stat().st_size
+    for last_used, size, path in datasets:
+        if now - last_used <= DATASET_MAX_AGE and total <= DATASET_MAX_BYTES:
+            break
+        if now - last_used <= DATASET_EVICT_GRACE:
+            break
+        if _in_use(path):
+            continue
+        print(f"[DB] Evicting dataset {path.stem} ({size:,} bytes, idle {now - last_used:.0f}s)")
+        _drop_dataset(path)
+        total -= size
+
 def save_uploaded_csv(file) -> str:
-    """Save uploaded CSV and return file path."""
-    file_id = str(uuid.uuid4())[:8]
-    file_path = UPLOAD_DIR / f"{file_id}_{file.name}"
-    with open(file_path, "wb") as f:
-        f.write(file.getbuffer())
-    print(f"[DB] Saved upload: {file_path}")
+    """Save an upload under its SHA-256 and return the file path.
+
+    The content is hashed while it is copied to disk; if the same bytes were
+    uploaded before, the existing copy is kept and only marked as recently used.
+    """
+    digest = hashlib.sha256()
+    tmp_path = UPLOAD_DIR / f".upload-{uuid.uuid4().hex}"
+    file.seek(0)
+    with open(tmp_path, "wb") as f:
+        while block := file.read(UPLOAD_COPY_BYTES):
+            digest.update(block)
+            f.write(block)
+
+    file_path = UPLOAD_DIR / f"{digest.hexdigest()}{Path(file.name).suffix.lower()}"
+    if file_path.exists():
+        tmp_path.unlink()
+        os.utime(file_path)
+        print(f"[DB] Upload already stored: {file_path}")
+    else:
+        os.replace(tmp_path, file_path)
+        print(f"[DB] Saved upload: {file_path}")
+    evict_uploads(keep=file_path)
     return str(file_path)
 
-def get_create_table_sql(csv_path: str) -> str:
+def evict_uploads(keep: Optional[Path] = None):
+    """Delete least recently used uploads until the store fits UPLOAD_MAX_BYTES."""
+    files = sorted(
+        (p.stat().st_mtime, p.stat().st_size, p)
+        for p in UPLOAD_DIR.iterdir() if p.is_file() and p != keep
+    )
+    total = sum(size for _, size, _ in files) + (keep.stat().st_size if keep else 0)
+    for _, size, path in files:
+        if total <= UPLOAD_MAX_BYTES:
+            break
+        print(f"[DB] Evicting upload {path.name} ({size:,} bytes)")
+        path.unlink(missing_ok=True)
+        total -= size
+
+def upload_dataset_id(upload_path: str, sheet: Optional[str] = None) -> str:
+    """Dataset id for a stored upload: identical content (and sheet) maps to the same dataset."""
+    dataset_id = Path(upload_path).stem[:16]
+    if sheet is not None:
+        dataset_id += "-" + hashlib.sha1(sheet.encode()).hexdigest()[:6]
+    return dataset_id
+
+def list_sheets(file) -> list:
+    """Worksheet names of an XLSX path or file object.
+
+    openpyxl still parses the shared strings and styles to open the workbook,
+    which takes seconds on large files, so callers should cache the result.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+def dataset_ready(dataset_id: str) -> bool:
+    """True if the dataset was fully loaded earlier (and marks it as recently used)."""
+    path = dataset_path(dataset_id)
+    if not path.exists():
+        return False
+    os.utime(path)
+    return True
+
+def get_create_table_sql(sample: "pd.DataFrame") -> str:
     """Send first 10 rows to LLM → get CREATE TABLE SQL."""
-    df = pd.read_csv(csv_path)
-    sample = df.head(10).to_csv(index=False)
+    sample = sample.head(10).to_csv(index=False)
 
     from langchain_openai import ChatOpenAI
     llm = ChatOpenAI(model=llm_model, temperature=0)
@@ -60,32 +300,252 @@ Return ONLY the clean SQL !
     print(f"[LLM] Generated CREATE TABLE:\n{sql}")
     return sql
 
-def create_and_load_table(csv_path: str):
-    """Create table from LLM SQL and insert all data."""
-    df = pd.read_csv(csv_path)
+def get_create_sql(sample: "pd.DataFrame") -> str:
+    """CREATE TABLE for the sample: local inference, or the LLM when SCHEMA_INFERENCE=llm."""
+    if SCHEMA_INFERENCE == "llm":
+        try:
+            create_sql = get_create_table_sql(sample)
+            dangerous = ["DROP TABLE", "DROP DATABASE", "DELETE", "UPDATE", "INSERT", "ALTER"]
+            if any(k in create_sql.upper() for k in dangerous):
+                raise ValueError("LLM returned unsafe SQL")
+            return create_sql
+        except Exception as e:
+            print(f"[DB] LLM schema inference failed ({e}), falling back to local inference")
 
-    create_sql = get_create_table_sql(csv_path)
+    create_sql = build_create_table_sql(infer_schema(sample))
+    print(f"[DB] Inferred CREATE TABLE:\n{create_sql}")
+    return create_sql
 
-    dangerous = ["DROP TABLE", "DROP DATABASE", "DELETE", "UPDATE", "INSERT", "ALTER"]
-    if any(k in create_sql.upper() for k in dangerous):
-        raise ValueError("LLM returned unsafe SQL")
+def _connect_for_load(path: Path) -> sqlite3.Connection:
+    """Writer connection tuned for bulk loading; transactions are managed explicitly."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{LOAD_CACHE_KIB}")
+    return conn
 
-    conn = sqlite3.connect(DB_PATH)
+def _iter_csv_chunks(csv_path: str, chunk_rows: int):
+    """Yield (chunk, fraction_of_file_read) in a single pass over the CSV."""
+    import pandas as pd
+
+    total_bytes = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_rows):
+            yield chunk, (f.tell() / total_bytes if total_bytes else 1.0)
+
+def _xlsx_columns(header: tuple) -> list:
+    """Header cells as unique column names; blank cells become column_<n>."""
+    columns = []
+    for i, cell in enumerate(header, 1):
+        name = str(cell).strip() if cell is not None and str(cell).strip() else f"column_{i}"
+        base, n = name, 1
+        while name in columns:
+            name = f"{base}.{n}"
+            n += 1
+        columns.append(name)
+    return columns
+
+_DATE_FORMAT = "%Y-%m-%d"
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_TEMPORAL = (datetime.date, datetime.time, datetime.timedelta)
+
+def _is_temporal(value) -> bool:
+    return isinstance(value, _TEMPORAL) and value == value  # NaT is a datetime but never equal
+
+def _temporal_text(value, has_time: bool):
+    """ISO text for a date, datetime, time or duration cell; other values unchanged."""
+    if not _is_temporal(value):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.strftime(_DATETIME_FORMAT if has_time else _DATE_FORMAT)
+    if isinstance(value, datetime.timedelta):
+        # Durations as Excel shows them with [h]:mm:ss, hours not wrapped into days.
+        seconds = round(value.total_seconds())
+        sign, seconds = ("-" if seconds < 0 else ""), abs(seconds)
+        return f"{sign}{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return value.isoformat()
+
+def _xlsx_frame(rows: list, columns: list) -> "pd.DataFrame":
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    # Dates, times and durations become ISO text, as they would arrive from a
+    # CSV export; sqlite3 cannot bind time or timedelta values at all.
+    for col in df.select_dtypes(include="datetime").columns:
+        values = df[col]
+        has_time = (values.dropna() != values.dropna().dt.normalize()).any()
+        df[col] = values.dt.strftime(_DATETIME_FORMAT if has_time else _DATE_FORMAT)
+    for col in df.select_dtypes(include=["object", "timedelta"]).columns:
+        values = df[col]
+        temporal = values.map(_is_temporal)
+        if not temporal.any():
+            continue
+        has_time = any(
+            isinstance(v, datetime.datetime) and v.time() != datetime.time() for v in values[temporal]
+        )
+        df[col] = values.map(lambda v: _temporal_text(v, has_time)).astype(object)
+    return df
+
+def _iter_xlsx_chunks(xlsx_path: str, chunk_rows: int, sheet: Optional[str] = None):
+    """Yield (chunk, fraction_of_rows_read) streaming one sheet in read-only mode.
+
+    Only `chunk_rows` rows are held at a time, so memory does not grow with the workbook.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
     try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        total_rows = ws.max_row or 0
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _xlsx_columns(header)
+        width = len(columns)
+
+        batch, read = [], 1
+        for row in rows:
+            read += 1
+            if all(v is None for v in row):
+                continue
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                yield _xlsx_frame(batch, columns), (read / total_rows if total_rows else 0.0)
+                batch = []
+        if batch:
+            yield _xlsx_frame(batch, columns), 1.0
+    finally:
+        wb.close()
+
+def _iter_chunks(path: str, chunk_rows: int, sheet: Optional[str] = None):
+    if Path(path).suffix.lower() in (".xlsx", ".xlsm"):
+        return _iter_xlsx_chunks(path, chunk_rows, sheet)
+    return _iter_csv_chunks(path, chunk_rows)
+
+def _chunk_rows(chunk: "pd.DataFrame"):
+    """Plain Python tuples for executemany (NaN → NULL, numpy scalars unboxed)."""
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+def create_and_load_table(csv_path: str, progress=None, chunk_rows: int = CHUNK_ROWS,
+                          dataset_id: Optional[str] = None, sheet: Optional[str] = None):
+    """Create table from the inferred schema and stream all data into it in bounded chunks.
+
+    Accepts CSV or XLSX (first sheet unless `sheet` is given); both feed the same pipeline.
+
+    Loads into the dataset's own database file, so other sessions keep querying
+    theirs undisturbed. Datasets are built in a staging file and renamed into
+    place on success, so a dataset file only ever exists fully loaded.
+    `progress(rows_loaded, fraction)` is called after every chunk, if given.
+    With COLUMNAR_SIDECAR=1 the committed table is also exported for columnar.query.
+    """
+    if dataset_id is not None:
+        evict_datasets(keep=dataset_id)
+
+    chunks = _iter_chunks(csv_path, chunk_rows, sheet)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError("Uploaded file contains no data rows")
+
+    create_sql = get_create_sql(first[0])
+
+    columns = ", ".join(quote_ident(c) for c in first[0].columns)
+    marks = ", ".join("?" for _ in first[0].columns)
+    insert_sql = f"INSERT INTO user_data ({columns}) VALUES ({marks})"
+
+    final_path = dataset_path(dataset_id)
+    if dataset_id is None:
+        load_path, version = final_path, None
+    else:
+        load_path = final_path.with_name(f"{final_path.name}.loading-{uuid.uuid4().hex[:8]}")
+        version = get_data_version(dataset_id) if final_path.exists() else 0
+
+    conn = _connect_for_load(load_path)
+    rows_loaded = 0
+    loaded = False
+    sidecar = None
+    try:
+        conn.execute("BEGIN")
         conn.execute("DROP TABLE IF EXISTS user_data")
         conn.execute(create_sql)
-        df.to_sql("user_data", conn, index=False, if_exists="append")
-        conn.commit()
-        print(f"[DB] Table `user_data` created and loaded with {len(df)} rows")
+        # user_version doubles as the data version that keys RESULT_CACHE.
+        if version is None:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.execute(f"PRAGMA user_version = {version + 1}")
+        declared = {row[1].lower(): row[2] for row in conn.execute("PRAGMA table_info(user_data)")}
+        profiler = ColumnProfiler(list(first[0].columns), declared)
+        for chunk, fraction in itertools.chain([first], chunks):
+            conn.executemany(insert_sql, _chunk_rows(chunk))
+            profiler.update(chunk)
+            rows_loaded += len(chunk)
+            if progress:
+                progress(rows_loaded, fraction)
+        profiler.save(conn)
+        conn.execute("COMMIT")
+        loaded = True
+        print(f"[DB] Table `user_data` created and loaded with {rows_loaded} rows")
+        if COLUMNAR_SIDECAR:
+            sidecar = _build_sidecar(conn, final_path, version + 1)
     except Exception as e:
-        conn.rollback()
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
         raise e
     finally:
         conn.close()
+        if load_path != final_path and not loaded:
+            _remove_db_files(load_path)
 
-def get_stats():
-    conn = sqlite3.connect(DB_PATH)
+    if load_path != final_path:
+        _close_pool(final_path.resolve())
+        # The old database's WAL (e.g. frames from an advisor index) would
+        # otherwise be replayed against the new file and corrupt it.
+        _remove_wal_files(final_path)
+        os.replace(load_path, final_path)
+    # Readers may still map the old sidecar, so it is replaced, never rewritten in place.
+    target = columnar.sidecar_path(final_path)
+    columnar.forget(target)
+    if sidecar:
+        os.replace(sidecar, target)
+    else:
+        Path(target).unlink(missing_ok=True)
+
+def _build_sidecar(conn: sqlite3.Connection, final_path: Path, version: int) -> Optional[str]:
+    """Stage the columnar export of the loaded table; None if it could not be written."""
+    staged = f"{columnar.sidecar_path(final_path)}.loading-{uuid.uuid4().hex[:8]}"
+    try:
+        started = time.perf_counter()
+        exported = columnar.write_sidecar(conn, staged, version)
+        print(f"[DB] Columnar sidecar: {len(exported)} columns in {time.perf_counter() - started:.2f}s")
+        return staged
+    except Exception as e:
+        print(f"[DB] Columnar sidecar skipped: {e}")
+        Path(staged).unlink(missing_ok=True)
+        return None
+
+def get_data_version(dataset_id: Optional[str] = None) -> int:
+    """Ingest counter stored in the database header; bumped by every table reload."""
+    with read_connection(dataset_id) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def get_schema_fingerprint(dataset_id: Optional[str] = None) -> str:
+    """Stable hash of user_data's column names and declared types."""
+    with read_connection(dataset_id) as conn:
+        cols = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info(user_data)")]
+    return hashlib.sha1(json.dumps(cols).encode()).hexdigest()
+
+def get_profile(dataset_id: Optional[str] = None) -> list:
+    """Per-column profile written at ingest time; empty if the table predates profiling."""
     try:
+        with read_connection(dataset_id) as conn:
+            return load_profile(conn)
+    except sqlite3.Error:
+        return []
+
+def _scan_stats(dataset_id: Optional[str] = None):
+    with read_connection(dataset_id) as conn:
         cur = conn.cursor()
         cur.execute("SELECT COUNT(*) FROM user_data")
         rows = cur.fetchone()[0]
@@ -102,21 +562,351 @@ def get_stats():
             except:
                 pass
         return {"rows": rows, "revenue": revenue, "top_product": top_product}
+
+def get_stats(dataset_id: Optional[str] = None):
+    try:
+        profile = get_profile(dataset_id)
+        if not profile:
+            return _scan_stats(dataset_id)
+        revenue = next(
+            (c["sum_value"] for c in profile if is_numeric_type(c["sql_type"]) and c["sum_value"]), 0
+        )
+        return {"rows": profile[0]["row_count"], "revenue": revenue, "top_product": "N/A"}
     except:
         return {"rows": 0, "revenue": 0, "top_product": "N/A"}
+
+@dataclass
+class QueryResult:
+    columns: list
+    rows: list
+    total_rows: Optional[int]  # None when counting would have cost a full scan
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_rows is None or self.total_rows > len(self.rows)
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+    def nbytes(self) -> int:
+        return sum(sys.getsizeof(v) for row in self.rows for v in row) + 64 * len(self.rows)
+
+def _count_rows(conn: sqlite3.Connection, sql: str) -> Optional[int]:
+    """Exact row count of `sql`, or None if it needs more than COUNT_BUDGET_OPS VM steps."""
+    conn.set_progress_handler(lambda: 1, COUNT_BUDGET_OPS)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM ({sql.strip().rstrip(';')})").fetchone()[0]
+    except sqlite3.Error:
+        return None
     finally:
-        conn.close()
+        conn.set_progress_handler(None, 0)
+
+def run_query(sql: str, max_rows: int = PREVIEW_ROWS, timeout: Optional[float] = None,
+              dataset_id: Optional[str] = None) -> QueryResult:
+    """Fetch at most `max_rows` rows from the cursor; the rest of the result is never built.
+
+    With `timeout`, SQLite aborts the statement once the deadline passes.
+    """
+    with read_connection(dataset_id) as conn, span("sql.execute") as s:
+        if timeout:
+            deadline = time.monotonic() + timeout
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            result = _query_sidecar(conn, sql, max_rows, dataset_id)
+            s.set(engine="sqlite" if result is None else "columnar")
+            if result is None:
+                started = time.perf_counter()
+                result = _fetch_result(conn, sql, max_rows)
+                if INDEX_ADVISOR_ENABLED:
+                    INDEX_ADVISOR.observe(conn, dataset_id, sql, time.perf_counter() - started)
+            s.set(rows=len(result.rows), total_rows=result.total_rows)
+            return result
+        finally:
+            conn.set_progress_handler(None, 0)
+
+def _query_sidecar(conn: sqlite3.Connection, sql: str, max_rows: int,
+                   dataset_id: Optional[str]) -> Optional[QueryResult]:
+    """Answer from the columnar sidecar when the query is in its subset."""
+    path = columnar.sidecar_path(dataset_path(dataset_id))
+    if not os.path.exists(path):
+        return None
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    answer = columnar.query(path, version, sql)
+    if answer is None:
+        return None
+    columns, rows = answer
+    print("[DB] Answered from columnar sidecar")
+    return QueryResult(columns, rows[:max_rows], len(rows))
+
+def _fetch_result(conn: sqlite3.Connection, sql: str, max_rows: int) -> QueryResult:
+    cur = conn.execute(sql)
+    columns = [d[0] for d in cur.description or []]
+    rows = []
+    while len(rows) <= max_rows:
+        batch = cur.fetchmany(min(FETCH_BATCH, max_rows + 1 - len(rows)))
+        if not batch:
+            break
+        rows.extend(batch)
+    cur.close()
+    if len(rows) <= max_rows:
+        return QueryResult(columns, rows, len(rows))
+    return QueryResult(columns, rows[:max_rows], _count_rows(conn, sql))
+
+_CLAUSE = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|UNION|EXCEPT|INTERSECT)\b", re.I)
+_IDENT = re.compile(r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|\b([A-Za-z_][A-Za-z0-9_]*)\b')
+
+def _clause_columns(sql: str, columns: dict) -> dict:
+    """Table columns referenced per clause: {"where"|"group"|"order": [column, ...]}."""
+    sql = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    parts = _CLAUSE.split(sql)
+    found = {}
+    for keyword, body in zip(parts[1::2], parts[2::2]):
+        kind = keyword.split()[0].lower()
+        if kind not in ("where", "group", "order"):
+            continue
+        for match in _IDENT.finditer(body):
+            name = next(g for g in match.groups() if g is not None).replace('""', '"')
+            column = columns.get(name.lower())
+            if column and column not in found.setdefault(kind, []):
+                found[kind].append(column)
+    return found
+
+class _Workload:
+    """What the advisor knows about one dataset file at one data version."""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.scans = Counter()
+        self.samples = {}
+        self.indexes = {}
+        self.rejected = set()
+        self.pending = set()
+        self.plans = deque(maxlen=QUERY_LOG_SIZE)
+        self.decisions = []
 
-def safe_execute(sql: str) -> str:
+class IndexAdvisor:
+    """Workload-driven single-column indexes, maintained outside the LLM's reach.
+
+    Every query SQLite executes is logged with its EXPLAIN QUERY PLAN. Columns
+    that keep appearing in WHERE/GROUP BY/ORDER BY of full table scans are
+    indexed by a background thread, which times the triggering query before and
+    after: an index that does not speed it up by INDEX_MIN_SPEEDUP is dropped
+    again. Auto indexes stay within INDEX_MAX_BYTES per dataset, the least used
+    being dropped first. Indexes never change results, so caches stay valid.
+    """
+
+    PREFIX = "auto_idx_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workloads = {}
+        self._tasks = queue.Queue()
+        self._worker = None
+
+    def _workload(self, conn: sqlite3.Connection, path: Path) -> _Workload:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        workload = self._workloads.get(path)
+        if workload is None or workload.version != version:
+            workload = self._workloads[path] = _Workload(version)
+            for name, column in conn.execute(
+                "SELECT il.name, ii.name FROM sqlite_master AS il, pragma_index_info(il.name) AS ii "
+                "WHERE il.type = 'index' AND il.tbl_name = 'user_data' AND il.name LIKE ?",
+                (self.PREFIX + "%",),
+            ):
+                workload.indexes[name] = {"column": column, "bytes": None, "hits": 0, "created": 0.0}
+        return workload
+
+    def observe(self, conn: sqlite3.Connection, dataset_id: Optional[str], sql: str, elapsed: float):
+        """Log the plan of a query that just ran and queue indexes for hot scanned columns."""
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            columns = {row[1].lower(): row[1] for row in conn.execute("PRAGMA table_info(user_data)")}
+        except sqlite3.Error:
+            return
+        full_scan = any(re.match(r"SCAN (TABLE )?user_data\b(?!.*INDEX)", d) for d in plan)
+        sorts = any(d.startswith("USE TEMP B-TREE") for d in plan)
+        referenced = _clause_columns(sql, columns)
+        path = dataset_path(dataset_id).resolve()
+
+        with self._lock:
+            workload = self._workload(conn, path)
+            workload.plans.append({"sql": sql, "plan": plan, "ms": round(elapsed * 1000, 1),
+                                   "at": time.time()})
+            for name, index in workload.indexes.items():
+                if any(f"INDEX {name} " in f"{d} " for d in plan):
+                    index["hits"] += 1
+            if not full_scan:
+                return
+            candidates = referenced.get("where", [])
+            if sorts:
+                candidates += referenced.get("group", []) + referenced.get("order", [])
+            indexed = {index["column"] for index in workload.indexes.values()}
+            for column in dict.fromkeys(candidates):
+                workload.scans[column] += 1
+                workload.samples[column] = sql
+                if (workload.scans[column] >= INDEX_MIN_SCANS and column not in indexed
+                        and column not in workload.rejected and column not in workload.pending):
+                    workload.pending.add(column)
+                    self._tasks.put((dataset_id, path, workload.version, column, sql))
+            if self._tasks.qsize() and self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="index-advisor", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            dataset_id, path, version, column, sql = self._tasks.get()
+            try:
+                self._consider(dataset_id, path, version, column, sql)
+            except Exception as e:
+                self._decide(path, version, column, "error", str(e))
+            finally:
+                with self._lock:
+                    workload = self._workloads.get(path)
+                    if workload is not None:
+                        workload.pending.discard(column)
+
+    def _time(self, dataset_id: Optional[str], sql: str) -> float:
+        """Median seconds to run `sql` as run_query would."""
+        timings = []
+        with read_connection(dataset_id) as conn:
+            deadline = time.monotonic() + INDEX_TIMING_BUDGET
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+            try:
+                for _ in range(INDEX_TIMING_RUNS):
+                    started = time.perf_counter()
+                    _fetch_result(conn, sql, RESULT_MAX_ROWS)
+                    timings.append(time.perf_counter() - started)
+            except sqlite3.OperationalError:
+                return INDEX_TIMING_BUDGET
+            finally:
+                conn.set_progress_handler(None, 0)
+        return sorted(timings)[len(timings) // 2]
+
+    def _consider(self, dataset_id: Optional[str], path: Path, version: int, column: str, sql: str):
+        name = self.PREFIX + re.sub(r"\W", "_", column)[:40] + "_" + hashlib.sha1(column.encode()).hexdigest()[:6]
+        before = self._time(dataset_id, sql)
+
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+                return
+            started = time.perf_counter()
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(name)} ON user_data ({quote_ident(column)})")
+            conn.execute(f"ANALYZE {quote_ident(name)}")
+            conn.commit()
+            build = time.perf_counter() - started
+            size = self._index_bytes(conn, name)
+        finally:
+            conn.close()
+
+        after = self._time(dataset_id, sql)
+        timings = {"before_ms": round(before * 1000, 1), "after_ms": round(after * 1000, 1),
+                   "build_ms": round(build * 1000, 1), "bytes": size}
+        if after * INDEX_MIN_SPEEDUP > before:
+            self._drop(path, name)
+            with self._lock:
+                workload = self._workloads.get(path)
+                if workload is not None:
+                    workload.rejected.add(column)
+            self._decide(path, version, column, "rejected", "no speedup on the triggering query", timings)
+            return
+
+        with self._lock:
+            workload = self._workloads.get(path)
+            if workload is None or workload.version != version:
+                return
+            workload.indexes[name] = {"column": column, "bytes": size, "hits": 0, "created": time.time()}
+        self._decide(path, version, column, "created", name, timings)
+        self._enforce_budget(path, version, keep=name)
+
+    def _index_bytes(self, conn: sqlite3.Connection, name: str) -> Optional[int]:
+        try:
+            return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _enforce_budget(self, path: Path, version: int, keep: str):
+        """Drop the least used auto indexes (the newest last) until they fit INDEX_MAX_BYTES."""
+        with self._lock:
+            workload = self._workloads.get(path)
+            indexes = dict(workload.indexes) if workload is not None else {}
+        total = sum(index["bytes"] or 0 for index in indexes.values())
+        order = sorted(indexes, key=lambda n: (n == keep, indexes[n]["hits"], indexes[n]["created"]))
+        for name in order:
+            if total <= INDEX_MAX_BYTES:
+                break
+            self._drop(path, name)
+            total -= indexes[name]["bytes"] or 0
+            with self._lock:
+                if path in self._workloads:
+                    self._workloads[path].indexes.pop(name, None)
+            self._decide(path, version, indexes[name]["column"], "dropped",
+                         f"over the {INDEX_MAX_BYTES // (1024 * 1024)} MB index budget")
+
+    def _drop(self, path: Path, name: str):
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute(f"DROP INDEX IF EXISTS {quote_ident(name)}")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _decide(self, path: Path, version: int, column: str, action: str, detail: str,
+                timings: Optional[dict] = None):
+        decision = {"column": column, "action": action, "detail": detail, "at": time.time(), **(timings or {})}
+        print(f"[DB] Index advisor: {action} {column} ({detail}) {timings or ''}")
+        with self._lock:
+            workload = self._workloads.get(path)
+            if workload is not None and workload.version == version:
+                workload.decisions.append(decision)
+
+    def report(self, dataset_id: Optional[str] = None) -> dict:
+        """Current auto indexes, decisions with timings, scan counts and recent plans."""
+        with self._lock:
+            workload = self._workloads.get(dataset_path(dataset_id).resolve())
+            if workload is None:
+                return {"indexes": [], "decisions": [], "scans": {}, "plans": []}
+            return {
+                "indexes": [{"name": n, **i} for n, i in workload.indexes.items()],
+                "decisions": list(workload.decisions),
+                "scans": dict(workload.scans),
+                "plans": list(workload.plans),
+            }
+
+INDEX_ADVISOR = IndexAdvisor()
+
+def get_index_report(dataset_id: Optional[str] = None) -> dict:
+    return INDEX_ADVISOR.report(dataset_id)
+
+def get_result(result_id: str) -> Optional[QueryResult]:
+    """Result behind a `result_id` handle returned by safe_execute, if still cached."""
+    return RESULT_HANDLES.get(result_id)
+
+def safe_execute(sql: str, timeout: Optional[float] = None, dataset_id: Optional[str] = None) -> str:
     dangerous = ["DELETE", "DROP", "UPDATE", "INSERT", "CREATE", "ALTER"]
     if any(k in sql.upper() for k in dangerous):
         return "BLOCKED: Dangerous operation."
-    try:
-        print(f"[DB] Executing SQL:\n{sql}")
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query(sql, conn)
-        print(df)
-        conn.close()
-        return df.head(10).to_markdown(index=False, tablefmt="pipe")
-    except Exception as e:
-        return f"SQL ERROR: {e}"
\ No newline at end of file
+    with span("sql") as s:
+        try:
+            key = (dataset_id, normalize_sql(sql), get_data_version(dataset_id), RESULT_MAX_ROWS)
+            result = RESULT_CACHE.get(key)
+            s.set(cache_hit=result is not None)
+            if result is None:
+                print(f"[DB] Executing SQL:\n{sql}")
+                result = run_query(sql, max_rows=RESULT_MAX_ROWS, timeout=timeout, dataset_id=dataset_id)
+                RESULT_CACHE.put(key, result, result.nbytes())
+            else:
+                print(f"[DB] Result cache hit:\n{sql}")
+            result_id = "r" + hashlib.sha1(repr(key).encode()).hexdigest()[:10]
+            RESULT_HANDLES.put(result_id, result, result.nbytes())
+            s.set(result_id=result_id, rows=len(result.rows), total_rows=result.total_rows,
+                  result_bytes=result.nbytes())
+
+            encoded = encode_result(result, result_id)
+            s.set(encoded_tokens=estimate_tokens(encoded))
+            return encoded
+        except Exception as e:
+            s.set(sql_error=str(e))
+            return f"SQL ERROR: {e}"
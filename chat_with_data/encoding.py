@@ -0,0 +1,135 @@
+"""Compact, token-budgeted encoding of query results for tool messages.
+
+Rows are written as minimal CSV, with floats rounded and long text
+clipped. Columns that are all NULL or constant in the fetched rows are moved
+to a single line instead of being repeated per row. A complete result shows as
+many rows as fit in the budget. A truncated one (a raw row dump past
+RESULT_MAX_ROWS) shows at most TRUNCATED_ROWS rows, because the model should
+aggregate in SQL rather than read them. When rows are left out, the message
+says exactly how many and adds per-column summary statistics, so the model
+can still answer questions about the whole result.
+"""
+import csv
+import io
+import math
+import os
+from collections import Counter
+
+RESULT_TOKEN_BUDGET = int(os.getenv("RESULT_TOKEN_BUDGET", "600"))
+CHARS_PER_TOKEN = 4  # rough average for English text and numbers in GPT tokenizers
+MAX_TEXT_CHARS = 40
+TOP_VALUES = 3
+TRUNCATED_ROWS = int(os.getenv("RESULT_TRUNCATED_ROWS", "10"))
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_value(value) -> str:
+    """Short text for one cell: NULL as empty, floats rounded, long text clipped."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isfinite(value) and value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        if abs(value) >= 1:
+            return f"{value:.2f}".rstrip("0").rstrip(".")
+        return f"{value:.4g}"
+    text = str(value)
+    return text if len(text) <= MAX_TEXT_CHARS else text[:MAX_TEXT_CHARS - 1] + "…"
+
+
+def _csv_line(values) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="").writerow(values)
+    return buf.getvalue()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _summary(columns: list, rows: list) -> list:
+    """One line per column: min/max/mean/sum for numbers, distinct and top values for text."""
+    lines = []
+    for i, name in enumerate(columns):
+        values = [r[i] for r in rows if r[i] is not None]
+        nulls = len(rows) - len(values)
+        null_note = f", {nulls} null" if nulls else ""
+        if values and all(_is_number(v) for v in values):
+            total = math.fsum(values)
+            lines.append(
+                f"{name}: min {format_value(min(values))}, max {format_value(max(values))}, "
+                f"mean {format_value(total / len(values))}, sum {format_value(total)}{null_note}"
+            )
+        elif values:
+            counts = Counter(map(str, values))
+            top = counts.most_common(TOP_VALUES)
+            top_note = ""
+            if top[0][1] > 1:
+                top_note = ", top " + ", ".join(f"{format_value(v)} ({n})" for v, n in top)
+            lines.append(f"{name}: {len(counts)} distinct{top_note}{null_note}")
+        else:
+            lines.append(f"{name}: all null")
+    return lines
+
+
+def encode_result(result, result_id: str, budget: int = RESULT_TOKEN_BUDGET) -> str:
+    """Render a QueryResult for the model within about `budget` tokens."""
+    columns, rows = list(result.columns), result.rows
+    lines = [f"result_id: {result_id}"]
+    if not columns:
+        return lines[0] + "\nNo result columns."
+    if not rows:
+        return "\n".join(lines + [f"0 rows. Columns: {_csv_line(columns)}"])
+
+    # Columns with one value across every fetched row are stated once.
+    kept, folded = [], []
+    for i, name in enumerate(columns):
+        distinct = {r[i] for r in rows}
+        if len(rows) > 1 and len(distinct) == 1:
+            value = next(iter(distinct))
+            folded.append(f"{name}=NULL" if value is None else f"{name}={format_value(value)}")
+        else:
+            kept.append(i)
+    if not kept:
+        kept, folded = list(range(len(columns))), []
+
+    header = _csv_line(columns[i] for i in kept)
+    encoded = [_csv_line(format_value(r[i]) for i in kept) for r in rows]
+    fetched = len(rows)
+    total = result.total_rows
+
+    def footer(shown: int) -> list:
+        omitted = []
+        if total is not None and total > shown:
+            omitted.append(f"Showing {shown} of {total:,} rows; {total - shown:,} rows omitted.")
+        elif total is None:
+            omitted.append(
+                f"Showing {shown} of at least {fetched + 1:,} rows; at least {fetched + 1 - shown:,} "
+                "rows omitted (exact count skipped, it would need a full scan)."
+            )
+        return omitted
+
+    scope = "all rows" if total == fetched else f"the first {fetched:,} rows"
+    preamble = []
+    if folded:
+        preamble.append(f"Same in {scope}: " + "; ".join(folded))
+
+    complete = not result.truncated
+    if complete and estimate_tokens("\n".join(lines + preamble + [header] + encoded)) <= budget:
+        return "\n".join(lines + preamble + [header] + encoded)
+
+    projected = [tuple(r[i] for i in kept) for r in rows]
+    summary = [f"Summary of {scope}:"] + _summary([columns[i] for i in kept], projected)
+    used = estimate_tokens("\n".join(lines + preamble + summary + footer(fetched) + [header]))
+    shown = 0
+    max_shown = TRUNCATED_ROWS if result.truncated else len(encoded)
+    for line in encoded:
+        cost = estimate_tokens(line + "\n")
+        if shown >= max_shown or (shown and used + cost > budget):
+            break
+        used += cost
+        shown += 1
+    return "\n".join(lines + footer(shown) + preamble + [header] + encoded[:shown] + summary)
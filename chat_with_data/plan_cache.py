@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+PLAN_CACHE_PATH = Path("data/plan_cache.db")
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "500"))
+
+
+# Bumped whenever normalize_question changes; older caches are dropped on open.
+KEY_VERSION = 2
+
+
+def normalize_question(question: str) -> str:
+    """Fold case, whitespace and trailing question marks so trivially different phrasings share a plan.
+
+    Operators, signs and decimal points are kept: "qty < 50" and "qty > 50"
+    must never share a plan.
+    """
+    return " ".join(question.lower().split()).rstrip("?! ")
+
+
+class PlanCache:
+    """On-disk question → tool-call plan cache, keyed by the table's schema fingerprint.
+
+    A plan is the list of tool-call turns, each a list of {"name", "arguments"}
+    dicts. Entries expire after `ttl` seconds; the least recently used are
+    dropped beyond `max_entries`. A schema change alters the fingerprint, so
+    plans written against the old schema are never returned.
+    """
+
+    def __init__(self, path: Path = PLAN_CACHE_PATH, ttl: int = PLAN_CACHE_TTL,
+                 max_entries: int = PLAN_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < KEY_VERSION:
+                # Plans keyed by an older normalization may answer the wrong question.
+                conn.execute("DROP TABLE IF EXISTS plans")
+                conn.execute(f"PRAGMA user_version = {KEY_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plans (question TEXT, fingerprint TEXT, plan TEXT, "
+                "created REAL, last_used REAL, hits INTEGER DEFAULT 0, "
+                "PRIMARY KEY (question, fingerprint))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, question: str, fingerprint: str):
+        key = (normalize_question(question), fingerprint)
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT plan, created FROM plans WHERE question = ? AND fingerprint = ?", key
+                ).fetchone()
+                if row is None:
+                    return None
+                if time.time() - row[1] > self.ttl:
+                    conn.execute("DELETE FROM plans WHERE question = ? AND fingerprint = ?", key)
+                    return None
+                conn.execute(
+                    "UPDATE plans SET last_used = ?, hits = hits + 1 WHERE question = ? AND fingerprint = ?",
+                    (time.time(), *key),
+                )
+                return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def put(self, question: str, fingerprint: str, plan: list):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO plans (question, fingerprint, plan, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (normalize_question(question), fingerprint, json.dumps(plan), now, now),
+                )
+                conn.execute("DELETE FROM plans WHERE created < ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM plans WHERE rowid NOT IN "
+                    "(SELECT rowid FROM plans ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            conn.close()
+
+    def discard(self, question: str, fingerprint: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM plans WHERE question = ? AND fingerprint = ?",
+                    (normalize_question(question), fingerprint),
+                )
+        finally:
+            conn.close()
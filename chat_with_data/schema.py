@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SAMPLE_ROWS = 1000
+DATE_FORMATS = ["ISO8601", "%m/%d/%Y", "%d/%m/%Y", "%d.%m.%Y", "%Y/%m/%d"]
+
+
+@dataclass
+class ColumnSpec:
+    name: str
+    sql_type: str
+    nullable: bool
+
+
+def quote_ident(name) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def is_numeric_type(declared: str) -> bool:
+    """SQLite affinity rules: INT/REAL/FLOA/DOUB/NUMERIC/DECIMAL columns are numeric."""
+    declared = (declared or "").upper()
+    return any(t in declared for t in ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC"))
+
+
+def _is_date(values: "pd.Series") -> bool:
+    """True if every non-null value parses under one of DATE_FORMATS."""
+    import pandas as pd
+
+    if not values.str.contains(r"\d", regex=True).all():
+        return False
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+        if parsed.notna().all():
+            return True
+    return False
+
+
+def infer_column_type(series: "pd.Series") -> str:
+    """Map a sampled column to a SQLite type: INTEGER, REAL, DATE or TEXT."""
+    import pandas as pd
+
+    values = series.dropna()
+    if values.empty:
+        return "TEXT"
+
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(values):
+        # Integer columns with gaps come back from read_csv as float.
+        return "INTEGER" if (values == values.round()).all() else "REAL"
+
+    values = values.astype(str).str.strip()
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.notna().all():
+        return "INTEGER" if (numeric == numeric.round()).all() else "REAL"
+    if _is_date(values):
+        return "DATE"
+    return "TEXT"
+
+
+def infer_schema(sample: "pd.DataFrame") -> list:
+    """Infer column specs from the first SAMPLE_ROWS rows of a chunk.
+
+    Nullability is reported, not enforced: a sample can't prove later rows are non-null.
+    """
+    sample = sample.head(SAMPLE_ROWS)
+    return [
+        ColumnSpec(str(col), infer_column_type(sample[col]), bool(sample[col].isna().any()))
+        for col in sample.columns
+    ]
+
+
+def build_create_table_sql(specs: list, table: str = "user_data") -> str:
+    columns = ",\n".join(f"  {quote_ident(s.name)} {s.sql_type}" for s in specs)
+    return f"CREATE TABLE {quote_ident(table)} (\n{columns}\n)"
@@ -0,0 +1,255 @@
+"""Lightweight tracing for the answer pipeline.
+
+`span(name, **attrs)` times a block and records it with its trace and parent,
+taken from a context variable, so nested spans (an answer → an LLM round
+trip → a tool → SQL execution) form one trace without passing ids around.
+Finished spans go to every registered sink:
+
+    RingBufferSink   last N spans in memory, used by the UI (always on)
+    JsonlSink        one JSON object per line, TELEMETRY_SINKS=jsonl
+    PrometheusSink   histograms/counters in text exposition format, TELEMETRY_SINKS=prometheus;
+                     read via render_metrics() or the file it rewrites every few seconds
+
+Work handed to a thread pool keeps its parent span when submitted through `bind`.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+TELEMETRY_SINKS = [s for s in os.getenv("TELEMETRY_SINKS", "").split(",") if s]
+TELEMETRY_JSONL = Path(os.getenv("TELEMETRY_JSONL", "logs/telemetry.jsonl"))
+# e.g. for node_exporter's textfile collector; empty to keep metrics in memory only
+TELEMETRY_PROM_FILE = os.getenv("TELEMETRY_PROM_FILE", "logs/metrics.prom")
+TELEMETRY_PROM_INTERVAL = float(os.getenv("TELEMETRY_PROM_INTERVAL", "15"))
+RING_SIZE = int(os.getenv("TELEMETRY_RING_SIZE", "2000"))
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = ContextVar("telemetry_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    attrs: dict = field(default_factory=dict)
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the enclosed block as a child of the current span (or as a new trace)."""
+    parent = _current.get()
+    s = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else _new_id(),
+        span_id=_new_id(),
+        parent_id=parent.span_id if parent else None,
+        start=time.time(),
+        attrs=attrs,
+    )
+    token = _current.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+    except Exception as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator closed from another context; the span is still recorded.
+            pass
+        _emit(s)
+
+
+def bind(fn):
+    """`fn` wrapped to run under the caller's current span, e.g. in a worker thread."""
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+# --- sinks --------------------------------------------------------------------
+
+class RingBufferSink:
+    """The most recent `size` spans, queryable by trace."""
+
+    def __init__(self, size: int = RING_SIZE):
+        self._spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def emit(self, s: Span):
+        with self._lock:
+            self._spans.append(s)
+
+    def trace(self, trace_id: str) -> list:
+        """Spans of one trace in start order."""
+        with self._lock:
+            spans = [s for s in self._spans if s.trace_id == trace_id]
+        return sorted(spans, key=lambda s: s.start)
+
+
+class JsonlSink:
+    def __init__(self, path: Path = TELEMETRY_JSONL):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def emit(self, s: Span):
+        line = json.dumps(asdict(s), default=str)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+class PrometheusSink:
+    """Span duration histograms, error, token and cache counters per span name.
+
+    With a `path`, a background thread rewrites the file at most every
+    `interval` seconds, and only after new spans; emit never touches the disk.
+    """
+
+    def __init__(self, path: Optional[str] = TELEMETRY_PROM_FILE, interval: float = TELEMETRY_PROM_INTERVAL):
+        self.path = path or None
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._writer = None
+        self._buckets = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self._sums = defaultdict(float)
+        self._errors = defaultdict(int)
+        self._tokens = defaultdict(int)
+        self._cache = defaultdict(int)
+
+    def emit(self, s: Span):
+        seconds = (s.duration_ms or 0) / 1000
+        with self._lock:
+            buckets = self._buckets[s.name]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            buckets[-1] += 1
+            self._sums[s.name] += seconds
+            if s.error:
+                self._errors[s.name] += 1
+            for kind in ("prompt", "completion"):
+                if s.attrs.get(f"{kind}_tokens"):
+                    self._tokens[kind] += s.attrs[f"{kind}_tokens"]
+            if "cache_hit" in s.attrs:
+                self._cache[(s.name, "hit" if s.attrs["cache_hit"] else "miss")] += 1
+            if self.path and self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="prometheus-file", daemon=True)
+                self._writer.start()
+        self._dirty.set()
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                self.write()
+            except OSError as e:
+                print(f"[TELEMETRY] Writing {self.path} failed: {e}")
+            time.sleep(self.interval)
+
+    def write(self):
+        """Atomically replace the exposition file with the current metrics."""
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, self.path)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP chat_span_duration_seconds Duration of instrumented stages.",
+            "# TYPE chat_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, buckets in sorted(self._buckets.items()):
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f'chat_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'chat_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {buckets[-1]}')
+                lines.append(f'chat_span_duration_seconds_sum{{span="{name}"}} {self._sums[name]:.6f}')
+                lines.append(f'chat_span_duration_seconds_count{{span="{name}"}} {buckets[-1]}')
+            lines += ["# HELP chat_span_errors_total Spans that ended in an exception.",
+                      "# TYPE chat_span_errors_total counter"]
+            lines += [f'chat_span_errors_total{{span="{n}"}} {c}' for n, c in sorted(self._errors.items())]
+            lines += ["# HELP chat_llm_tokens_total Tokens reported by the model API.",
+                      "# TYPE chat_llm_tokens_total counter"]
+            lines += [f'chat_llm_tokens_total{{type="{k}"}} {c}' for k, c in sorted(self._tokens.items())]
+            lines += ["# HELP chat_cache_lookups_total Cache lookups by span and outcome.",
+                      "# TYPE chat_cache_lookups_total counter"]
+            lines += [f'chat_cache_lookups_total{{span="{n}",result="{r}"}} {c}'
+                      for (n, r), c in sorted(self._cache.items())]
+        return "\n".join(lines) + "\n"
+
+
+RING = RingBufferSink()
+PROMETHEUS = PrometheusSink() if "prometheus" in TELEMETRY_SINKS else None
+_sinks = [RING]
+if "jsonl" in TELEMETRY_SINKS:
+    _sinks.append(JsonlSink())
+if PROMETHEUS is not None:
+    _sinks.append(PROMETHEUS)
+
+
+def add_sink(sink):
+    """Register any object with an `emit(span)` method."""
+    _sinks.append(sink)
+
+
+def render_metrics() -> Optional[str]:
+    """Current metrics in Prometheus text format, or None unless TELEMETRY_SINKS includes prometheus."""
+    return PROMETHEUS.render() if PROMETHEUS is not None else None
+
+
+def _emit(s: Span):
+    for sink in list(_sinks):
+        try:
+            sink.emit(s)
+        except Exception as e:
+            print(f"[TELEMETRY] {type(sink).__name__} failed: {e}")
+
+
+def breakdown(trace_id: str) -> list:
+    """Rows for one trace from the ring buffer, depth-first, each with its nesting depth."""
+    spans = RING.trace(trace_id)
+    children = defaultdict(list)
+    for s in spans:
+        children[s.parent_id].append(s)
+    ids = {s.span_id for s in spans}
+    rows = []
+
+    def walk(s: Span, depth: int):
+        rows.append({"depth": depth, "name": s.name, "ms": s.duration_ms, "error": s.error, **s.attrs})
+        for child in children[s.span_id]:
+            walk(child, depth + 1)
+
+    for root in (s for s in spans if s.parent_id not in ids):
+        walk(root, 0)
+    return rows
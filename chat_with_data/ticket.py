@@ -1,40 +1,318 @@
+import json
 import os
-import requests
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def create_support_ticket(user_q: str, bot_a: str, ticket_description: str = "") -> str:
+TICKET_OUTBOX_PATH = Path(os.getenv("TICKET_OUTBOX_PATH", "data/ticket_outbox.db"))
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+TICKET_MAX_ATTEMPTS = int(os.getenv("TICKET_MAX_ATTEMPTS", "8"))
+TICKET_BACKOFF_BASE = float(os.getenv("TICKET_BACKOFF_BASE", "2"))
+TICKET_BACKOFF_MAX = float(os.getenv("TICKET_BACKOFF_MAX", "600"))
+TICKET_TIMEOUT = (5, 20)  # connect, read seconds
+TICKET_IDLE_POLL = 30.0
+
+
+class TicketOutbox:
+    """Durable queue of support tickets, delivered to GitHub by one background thread.
+
+    Tickets are committed to SQLite before the user gets an answer, so the
+    UI never waits on the network and a crash or outage loses nothing. The
+    worker posts them over a pooled keep-alive session, with exponential backoff
+    on connection errors and 5xx, and waits out rate limits (Retry-After,
+    X-RateLimit-Reset). Every submission gets its own key, chosen by the caller
+    or generated; enqueueing an existing key again only requeues it if it
+    failed. GitHub has no idempotent create, so the key is also written into
+    the issue body. When an earlier POST may have
+    reached GitHub (timeout, dropped connection, 5xx, or a restart mid-send),
+    recent issues are searched for that marker before posting again.
+    """
+
+    def __init__(self, path: Path = TICKET_OUTBOX_PATH, api_url: str = GITHUB_API_URL):
+        self.path = Path(path)
+        self.api_url = api_url.rstrip("/")
+        self._wake = threading.Event()
+        self._worker = None
+        self._session = None
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets (key TEXT PRIMARY KEY, owner TEXT, repo TEXT, "
+                "payload TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL, "
+                "issue_url TEXT, last_error TEXT, created REAL, updated REAL, uncertain INTEGER DEFAULT 0)"
+            )
+            if "uncertain" not in {row[1] for row in conn.execute("PRAGMA table_info(tickets)")}:
+                conn.execute("ALTER TABLE tickets ADD COLUMN uncertain INTEGER DEFAULT 0")
+            # A ticket caught mid-send by a restart may already exist on GitHub.
+            conn.execute("UPDATE tickets SET status = 'queued', uncertain = 1 WHERE status = 'sending'")
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return sqlite3.connect(self.path, timeout=5)
+
+    def enqueue(self, owner: str, repo: str, payload: dict, key: Optional[str] = None) -> str:
+        key = key or uuid.uuid4().hex[:24]
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO tickets (key, owner, repo, payload, status, next_attempt, created, updated) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                    "status = 'queued', attempts = 0, next_attempt = excluded.next_attempt, "
+                    "updated = excluded.updated WHERE status = 'failed'",
+                    (key, owner, repo, json.dumps(payload), now, now, now),
+                )
+        finally:
+            conn.close()
+        self.start()
+        self._wake.set()
+        return key
+
+    def status(self, key: str) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT status, attempts, next_attempt, issue_url, last_error, created, updated "
+                "FROM tickets WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        names = ["status", "attempts", "next_attempt", "issue_url", "last_error", "created", "updated"]
+        return {"key": key, **dict(zip(names, row))}
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ticket-outbox", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            wait = self.process_due()
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def process_due(self) -> float:
+        """Send every ticket that is due; seconds until the next one is (capped at TICKET_IDLE_POLL)."""
+        while (ticket := self._claim()) is not None:
+            self._deliver(*ticket)
+        conn = self._connect()
+        try:
+            due = conn.execute("SELECT MIN(next_attempt) FROM tickets WHERE status = 'queued'").fetchone()[0]
+        finally:
+            conn.close()
+        if due is None:
+            return TICKET_IDLE_POLL
+        return min(max(due - time.time(), 0.05), TICKET_IDLE_POLL)
+
+    def _claim(self):
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT key, owner, repo, payload, attempts, uncertain, created FROM tickets "
+                    "WHERE status = 'queued' AND next_attempt <= ? ORDER BY created LIMIT 1",
+                    (time.time(),),
+                ).fetchone()
+                if row is not None:
+                    claimed = conn.execute(
+                        "UPDATE tickets SET status = 'sending', updated = ? WHERE key = ? AND status = 'queued'",
+                        (time.time(), row[0]),
+                    ).rowcount
+                    if not claimed:  # another process got there first
+                        return self._claim()
+            return row
+        finally:
+            conn.close()
+
+    def _http(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount(self.api_url, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+            self._session = session
+        return self._session
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {os.getenv('GITHUB_TOKEN')}",
+            "Accept": "application/vnd.github.v3+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+
+    def _find_existing(self, key: str, owner: str, repo: str, created: float) -> Optional[str]:
+        """URL of an issue already filed for `key`, found by its body marker; None if there is none."""
+        since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created - 60))
+        response = self._http().get(
+            f"{self.api_url}/repos/{owner}/{repo}/issues",
+            params={"state": "all", "since": since, "sort": "created", "direction": "desc", "per_page": 100},
+            headers=self._headers(), timeout=TICKET_TIMEOUT,
+        )
+        response.raise_for_status()
+        marker = _marker(key)
+        for issue in response.json():
+            if marker in (issue.get("body") or ""):
+                return issue.get("html_url")
+        return None
+
+    def _deliver(self, key: str, owner: str, repo: str, payload: str, attempts: int,
+                 uncertain: int, created: float):
+        payload = json.loads(payload)
+        payload["body"] += f"\n\n{_marker(key)}"
+        url = f"{self.api_url}/repos/{owner}/{repo}/issues"
+        attempts += 1
+
+        if uncertain:
+            try:
+                issue_url = self._find_existing(key, owner, repo, created)
+            except Exception as e:
+                # Posting blind could file a duplicate; check again later instead.
+                self._retry(key, attempts, f"duplicate check failed: {type(e).__name__}: {e}",
+                            _rate_limit_wait(e.response) if getattr(e, "response", None) is not None else None,
+                            uncertain=True)
+                return
+            if issue_url:
+                print(f"[TICKET] {key} was already filed → {issue_url}")
+                self._update(key, status="created", attempts=attempts, issue_url=issue_url, last_error=None)
+                return
+
+        print(f"[TICKET] Sending {key} to {owner}/{repo} (attempt {attempts})...")
+        try:
+            response = self._http().post(url, json=payload, headers=self._headers(), timeout=TICKET_TIMEOUT)
+        except Exception as e:
+            import requests
+
+            # Only a failed connect proves the request never reached GitHub.
+            sent = not isinstance(e, requests.exceptions.ConnectTimeout)
+            self._retry(key, attempts, f"{type(e).__name__}: {e}", None, uncertain=sent)
+            return
+
+        if response.status_code in (200, 201):
+            issue_url = response.json().get("html_url")
+            print(f"[TICKET] Success → {issue_url}")
+            self._update(key, status="created", attempts=attempts, issue_url=issue_url, last_error=None)
+            return
+
+        try:
+            message = response.json().get("message", "Unknown error")
+        except ValueError:
+            message = response.text[:200] or "Unknown error"
+        error = f"{response.status_code} – {message}"
+        wait = _rate_limit_wait(response)
+        if wait is not None or response.status_code >= 500 or response.status_code == 408:
+            # A 5xx can come after the issue was created.
+            self._retry(key, attempts, error, wait, uncertain=response.status_code >= 500)
+        else:
+            print(f"[TICKET] Failed: {error}")
+            self._update(key, status="failed", attempts=attempts, last_error=error)
+
+    def _retry(self, key: str, attempts: int, error: str, wait: Optional[float], uncertain: bool = False):
+        if attempts >= TICKET_MAX_ATTEMPTS:
+            print(f"[TICKET] Giving up on {key} after {attempts} attempts: {error}")
+            self._update(key, status="failed", attempts=attempts, last_error=error)
+            return
+        if wait is None:
+            wait = min(TICKET_BACKOFF_BASE * 2 ** (attempts - 1), TICKET_BACKOFF_MAX)
+            wait *= random.uniform(0.5, 1.0)
+        print(f"[TICKET] {key} failed ({error}); retrying in {wait:.1f}s")
+        fields = {"uncertain": 1} if uncertain else {}
+        self._update(key, status="queued", attempts=attempts, last_error=error,
+                     next_attempt=time.time() + wait, **fields)
+
+    def _update(self, key: str, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"UPDATE tickets SET {assignments} WHERE key = ?", (*fields.values(), key))
+        finally:
+            conn.close()
+
+
+def _marker(key: str) -> str:
+    return f"<!-- ticket-key: {key} -->"
+
+
+def _rate_limit_wait(response) -> Optional[float]:
+    """Seconds the server asked us to wait, or None if this is not a rate limit response."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    if response.status_code in (403, 429) and response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = response.headers.get("X-RateLimit-Reset")
+        if reset and reset.isdigit():
+            return max(int(reset) - time.time(), 0.0) + 1
+    if response.status_code == 429:
+        return 60.0
+    return None
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def _tickets() -> TicketOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = TicketOutbox()
+            _outbox.start()
+    return _outbox
+
+def queue_support_ticket(user_q: str, bot_a: str, ticket_description: str = "",
+                         submission_id: Optional[str] = None) -> str:
+    """Queue a GitHub issue for the last exchange and return its key; never blocks on the network.
+
+    Passing the same `submission_id` again (a repeated click) files one issue;
+    without it every call is a new ticket.
+    """
     token = os.getenv("GITHUB_TOKEN")
     repo = os.getenv("GITHUB_REPO")
     user = os.getenv("GITHUB_USER")
 
     if not token or not repo:
         print("[TICKET] Missing GITHUB_TOKEN or GITHUB_REPO in .env")
-        return "GitHub credentials missing. Check .env file."
+        raise ValueError("GitHub credentials missing. Check .env file.")
 
-    url = f"https://api.github.com/repos/{user}/{repo}/issues"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
     payload = {
         "title": f"Chat issue – {user_q[:100]}",
         "body": f"**User query:**\n{user_q}\n\n**Bot answer:**\n{bot_a}\n\n**User description:**\n{ticket_description}"
     }
+    key = _tickets().enqueue(user, repo, payload, submission_id)
+    print(f"[TICKET] Queued {key} for {repo}")
+    return key
 
-    print(f"[TICKET] Creating issue in {repo}...")
+def create_support_ticket(user_q: str, bot_a: str, ticket_description: str = "") -> str:
+    """Queue a ticket and describe the outcome in one line for the UI."""
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
-        if response.status_code in (200, 201):
-            issue_url = response.json().get("html_url")
-            print(f"[TICKET] Success → {issue_url}")
-            return f"Support ticket created!\n{issue_url}"
-        else:
-            error_msg = response.json().get("message", "Unknown error")
-            print(f"[TICKET] Failed: {response.status_code} – {error_msg}")
-            return f"Failed to create ticket: {response.status_code} – {error_msg}"
+        key = queue_support_ticket(user_q, bot_a, ticket_description)
+    except ValueError as e:
+        return str(e)
     except Exception as e:
         print(f"[TICKET] Exception: {e}")
-        return f"Error creating ticket: {str(e)}"
\ No newline at end of file
+        return f"Error creating ticket: {str(e)}"
+    return f"Support ticket queued (id {key}); it will be filed in the background."
+
+def get_ticket_status(key: str) -> Optional[dict]:
+    """Delivery state of a queued ticket: status is queued, sending, created or failed."""
+    return _tickets().status(key)
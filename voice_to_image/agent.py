@@ -1,10 +1,12 @@
-import re
+import os
 import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-import requests
-from openai import OpenAI
-import openai
-from utils import setup_logging
+from typing import Optional
+from audio_prep import preprocess_audio
+from content_filter import get_content_filter, load_terms
+from transcription import SegmentedTranscriber, Transcriber
+from utils import audio_mime_type, setup_logging
 
 
 log = setup_logging()
@@ -18,33 +20,84 @@ class AudioToImagePipeline:
         "racist", "religion", "sex", "shoot", "suicide", "terror", "violence", "war", "weapon"
     }
 
-    def __init__(self, api_key: str):
+    # Clips up to this size are uploaded straight from memory.
+    SPILL_THRESHOLD_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, api_key: str, transcriber: Optional[Transcriber] = None):
+        from openai import OpenAI
+
         log.info("Initializing AudioToImagePipeline")
         self._api_client = OpenAI(api_key=api_key)
         self._temp_dir = Path(tempfile.gettempdir())
+        self._spill_bytes = int(os.getenv("TRANSCRIBE_SPILL_BYTES", self.SPILL_THRESHOLD_BYTES))
+        self._preprocess_audio = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+
+        # `transcriber(audio_bytes, filename) -> text` replaces the Whisper call, e.g. with a local fake.
+        self._transcriber = transcriber or self._transcribe_with_whisper
+        self._segmenter = None
+        if os.getenv("TRANSCRIBE_SEGMENTED", "1") == "1":
+            self._segmenter = SegmentedTranscriber(
+                self._transcribe_clip,
+                segment_seconds=float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "60")),
+                max_workers=int(os.getenv("TRANSCRIBE_MAX_PARALLEL", "4")),
+            )
+
+        # One term per line, `*` suffix for stems; replaces the built-in list.
+        terms_path = os.getenv("CONTENT_FILTER_TERMS")
+        terms = load_terms(terms_path) if terms_path else self.RESTRICTED_TERMS
+        self._content_filter = get_content_filter(terms)
+        log.info(f"Content filter ready | Terms: {len(self._content_filter.terms)}")
+
+    @contextmanager
+    def _upload_file(self, audio_data: bytes, audio_filename: str):
+        # The SDK takes a (filename, content, mime type) tuple; the name only
+        # tells Whisper the container format, nothing is read from that path.
+        name = Path(audio_filename).name or "audio.wav"
+        mime_type = audio_mime_type(name)
+
+        if len(audio_data) <= self._spill_bytes:
+            yield name, audio_data, mime_type
+            return
+
+        # Large clips are streamed from a private, uniquely named file that is
+        # removed as soon as the upload is done.
+        with tempfile.NamedTemporaryFile(dir=self._temp_dir, prefix="transcribe_",
+                                         suffix=Path(name).suffix) as spill_file:
+            spill_file.write(audio_data)
+            spill_file.flush()
+            spill_file.seek(0)
+            log.info(f"Spilled audio to disk for upload | Path: {spill_file.name}")
+            yield name, spill_file, mime_type
+
+    def _transcribe_with_whisper(self, audio_data: bytes, audio_filename: str) -> str:
+        with self._upload_file(audio_data, audio_filename) as upload:
+            log.info(f"Sending audio to Whisper API | File: {upload[0]} ({upload[2]})")
+            api_response = self._api_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=upload,
+                response_format="text",
+                language="en"
+            )
+
+        return (
+            api_response.strip()
+            if isinstance(api_response, str)
+            else api_response.text.strip()
+        )
+
+    def _transcribe_clip(self, audio_data: bytes, audio_filename: str) -> str:
+        if self._preprocess_audio:
+            audio_data, audio_filename = preprocess_audio(audio_data, audio_filename)
+        return self._transcriber(audio_data, audio_filename)
 
     def convert_speech_to_text(self, audio_data: bytes, audio_filename: str = "audio.wav") -> str:
-        temp_audio_path = None
         try:
             log.info(f"Starting speech transcription | Audio size: {len(audio_data)} bytes")
 
-            temp_audio_path = self._temp_dir / audio_filename
-            temp_audio_path.write_bytes(audio_data)
-
-            with temp_audio_path.open("rb") as audio_stream:
-                log.info("Sending audio to Whisper API")
-                api_response = self._api_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_stream,
-                    response_format="text",
-                    language="en"
-                )
-            
-            transcribed_text = (
-                api_response.strip()
-                if isinstance(api_response, str)
-                else api_response.text.strip()
-            )
+            if self._segmenter is not None:
+                transcribed_text = self._segmenter.transcribe(audio_data, audio_filename)
+            else:
+                transcribed_text = self._transcribe_clip(audio_data, audio_filename)
 
             log.info(f"Transcription successful | Preview: {transcribed_text[:60]}...")
             return transcribed_text
@@ -53,26 +106,14 @@ class AudioToImagePipeline:
             log.error(f"Speech transcription error: {error}", exc_info=True)
             raise RuntimeError(f"Unable to transcribe audio: {error}")
 
-        finally:
-            if temp_audio_path and temp_audio_path.exists():
-                try:
-                    temp_audio_path.unlink()
-                except OSError:
-                    pass
-
     def _apply_content_filter(self, raw_text: str) -> str:
         log.debug(f"Applying content filter | Input preview: {raw_text[:60]}...")
 
-        filtered_text = raw_text.lower()
-
-        for restricted_word in self.RESTRICTED_TERMS:
-            pattern = rf"\b{restricted_word}\b"
-            filtered_text = re.sub(pattern, "", filtered_text, flags=re.IGNORECASE)
+        result = self._content_filter.apply(raw_text)
+        if result.hits:
+            log.info(f"Content filter removed terms | Hits: {dict(result.hits)}")
 
-        filtered_text = re.sub(r"[^a-zA-Z0-9\s,\.]", "", filtered_text)
-        filtered_text = re.sub(r"\s+", " ", filtered_text).strip()
-
-        safe_prompt = f"A friendly, creative and artistic interpretation of: {filtered_text}"
+        safe_prompt = f"A friendly, creative and artistic interpretation of: {result.text}"
 
         log.debug(f"Filter applied | Output preview: {safe_prompt[:60]}...")
         return safe_prompt
@@ -112,6 +153,9 @@ class AudioToImagePipeline:
             raise RuntimeError(f"Unable to optimize prompt: {error}")
 
     def synthesize_image(self, image_description: str) -> bytes:
+        import openai
+        import requests
+
         try:
             safe_description = self._apply_content_filter(image_description)
             
@@ -149,6 +193,8 @@ class AudioToImagePipeline:
             "gentle lighting, and peaceful composition with harmonious elements."
         )
         
+        import requests
+
         try:
             log.info("Attempting fallback image generation")
 
@@ -3,9 +3,6 @@ import os
 from dotenv import load_dotenv
 from agent import AudioToImagePipeline
 from utils import setup_logging, format_file_size, validate_audio_format
-import openai
-from openai import OpenAI
-from audio_recorder_streamlit import audio_recorder
 
 
 app_logger = setup_logging()
@@ -127,6 +124,8 @@ def execute_audio_to_image_pipeline(audio_data: bytes, audio_name: str = "audio.
 
 
 if selected_method == "record":
+    from audio_recorder_streamlit import audio_recorder
+
     st.markdown("---")
     st.subheader("🎙️ Record Audio")
 
@@ -190,6 +189,4 @@ elif selected_method == "upload":
             use_container_width=True,
             type="primary"
         ):
-            audio_file.seek(0)
-            file_data = audio_file.read()
-            execute_audio_to_image_pipeline(file_data, audio_file.name)
+            execute_audio_to_image_pipeline(audio_file.getvalue(), audio_file.name)
@@ -0,0 +1,111 @@
+"""Shrink audio before it is uploaded for transcription.
+
+Speech needs far less than what browsers and recorders produce: a 44.1/48 kHz
+stereo WAV from `audio_recorder` is mostly redundant. `preprocess_audio` runs
+the clip through ffmpeg once: mono, 16 kHz (Whisper's internal rate), leading
+and trailing silence trimmed, encoded as low-bitrate Opus in Ogg. Clips that
+are already small, or that ffmpeg (from PATH or FFMPEG_BINARY) cannot make
+smaller, are uploaded unchanged, as is everything when ffmpeg is missing.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+from utils import format_file_size, setup_logging
+
+
+log = setup_logging()
+
+TARGET_SAMPLE_RATE = 16000
+SILENCE_THRESHOLD_DB = -45
+KEEP_SILENCE_SECONDS = 0.25
+OPUS_BITRATE = "24k"
+FFMPEG_TIMEOUT_SECONDS = 120
+# Below this the ffmpeg start-up costs more than the upload it saves.
+MIN_PREPROCESS_BYTES = 128 * 1024
+
+# Containers that may keep their index at the end of the file, which ffmpeg
+# cannot reach when reading from a pipe.
+SEEKABLE_FORMATS = {".mp4", ".m4a", ".mov"}
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+def ffmpeg_binary() -> Optional[str]:
+    return os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def run_ffmpeg(audio_data: bytes, filename: str, output_args: list,
+               loglevel: str = "error") -> subprocess.CompletedProcess:
+    binary = ffmpeg_binary()
+    if not binary:
+        raise FFmpegError("ffmpeg not found; install it or set FFMPEG_BINARY")
+
+    def run(input_arg: str, stdin_data: Optional[bytes]):
+        command = [binary, "-hide_banner", "-loglevel", loglevel, "-i", input_arg, *output_args]
+        stdin = {"input": stdin_data} if stdin_data is not None else {"stdin": subprocess.DEVNULL}
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, **stdin)
+        except (OSError, subprocess.TimeoutExpired) as error:
+            raise FFmpegError(f"ffmpeg could not run: {error}")
+        if result.returncode != 0:
+            message = result.stderr.decode(errors="replace").strip().splitlines()
+            raise FFmpegError(f"ffmpeg exited with {result.returncode}: {message[-1] if message else ''}")
+        return result
+
+    suffix = Path(filename).suffix.lower()
+    if suffix not in SEEKABLE_FORMATS:
+        return run("pipe:0", audio_data)
+    with tempfile.NamedTemporaryFile(prefix="ffmpeg_", suffix=suffix) as source:
+        source.write(audio_data)
+        source.flush()
+        return run(source.name, None)
+
+
+def _trim_silence_filter() -> str:
+    trim = (f"silenceremove=start_periods=1:start_silence={KEEP_SILENCE_SECONDS}"
+            f":start_threshold={SILENCE_THRESHOLD_DB}dB")
+    # silenceremove only trims the start; reversing twice trims the end too.
+    return f"{trim},areverse,{trim},areverse"
+
+
+def preprocess_audio(audio_data: bytes, audio_filename: str) -> Tuple[bytes, str]:
+    """Return (bytes, filename) to upload: the compacted clip, or the input if that is not smaller."""
+    if len(audio_data) < MIN_PREPROCESS_BYTES:
+        log.info(f"Audio pre-processing skipped | Clip already small: {format_file_size(len(audio_data))}")
+        return audio_data, audio_filename
+
+    started = time.perf_counter()
+    try:
+        result = run_ffmpeg(audio_data, audio_filename, [
+            "-vn",
+            "-af", _trim_silence_filter(),
+            "-ac", "1",
+            "-ar", str(TARGET_SAMPLE_RATE),
+            "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip",
+            "-f", "ogg", "pipe:1",
+        ])
+    except FFmpegError as error:
+        log.warning(f"Audio pre-processing skipped | {error}")
+        return audio_data, audio_filename
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    processed = result.stdout
+    if not processed or len(processed) >= len(audio_data):
+        log.info(
+            f"Audio pre-processing kept original | Before: {format_file_size(len(audio_data))} | "
+            f"After: {format_file_size(len(processed))} | {elapsed_ms:.0f} ms"
+        )
+        return audio_data, audio_filename
+
+    log.info(
+        f"Audio pre-processed | Before: {format_file_size(len(audio_data))} | "
+        f"After: {format_file_size(len(processed))} | "
+        f"{len(audio_data) / len(processed):.1f}x smaller | {elapsed_ms:.0f} ms"
+    )
+    return processed, f"{Path(audio_filename).stem or 'audio'}.ogg"
@@ -0,0 +1,144 @@
+"""Single-pass restricted-term filter for image prompts.
+
+Terms are compiled once into a trie-shaped regular expression, so matching
+costs one scan of the prompt however many terms are configured. A term
+ending in `*` is a stem and also matches any longer word ("politic*" removes
+"political" and "politics"). A term may span several words ("hate speech",
+"self-harm"); words in the prompt may then be separated by any run of spaces
+or hyphens. Term files hold one term per line; blank lines and lines starting
+with `#` are ignored. Any other entry that is not such a term is rejected with
+ValueError, so a typo never silently leaves a policy term unenforced.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional
+
+_EXACT = ""  # trie keys for "a term ends here" / "a stem ends here"
+_STEM = "*"
+_SEPARATOR = " "  # trie key between the words of a multi-word term
+_SEPARATOR_PATTERN = r"[\s\-]+"
+_DISALLOWED = r"[^a-z0-9\s,\.]+"
+
+
+@dataclass
+class FilterResult:
+    text: str
+    hits: Counter = field(default_factory=Counter)
+
+
+def load_terms(path) -> list:
+    terms, invalid = [], []
+    for number, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if _normalize(line) is None:
+            invalid.append(f"{path}:{number}: {line!r}")
+        terms.append(line)
+    if invalid:
+        raise ValueError("Invalid content filter terms:\n" + "\n".join(invalid))
+    return terms
+
+
+def _normalize(term: str) -> Optional[str]:
+    """Canonical form of a term (words joined by one space, optional `*`), or None if it is invalid."""
+    term = term.strip().lower()
+    stem = term.endswith(_STEM)
+    words = re.split(_SEPARATOR_PATTERN, term[:-1] if stem else term)
+    if not all(re.fullmatch(r"\w+", word) for word in words):
+        return None
+    return _SEPARATOR.join(words) + (_STEM if stem else "")
+
+
+def _build_trie(terms: Iterable[str]) -> dict:
+    trie = {}
+    for term in terms:
+        node = trie
+        word, marker = (term[:-1], _STEM) if term.endswith(_STEM) else (term, _EXACT)
+        for char in word:
+            node = node.setdefault(char, {})
+        node[marker] = True
+    return trie
+
+
+def _trie_pattern(node: dict) -> str:
+    branches = []
+    single = []
+    for char in sorted(k for k in node if k not in (_EXACT, _STEM)):
+        child = node[char]
+        if char == _SEPARATOR:
+            branches.append(_SEPARATOR_PATTERN + _trie_pattern(child))
+        elif len(child) == 1 and _EXACT in child:
+            single.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + _trie_pattern(child))
+    if len(single) == 1:
+        branches.append(single[0])
+    elif single:
+        branches.append("[" + "".join(single) + "]")
+
+    if _STEM in node:
+        # Any continuation of the word matches; only further words still need branches.
+        if _SEPARATOR in node:
+            return rf"(?:{_SEPARATOR_PATTERN}{_trie_pattern(node[_SEPARATOR])}|\w*)"
+        return r"\w*"
+    if not branches:
+        return ""
+    if len(branches) == 1 and _EXACT not in node:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if _EXACT in node else pattern
+
+
+class ContentFilter:
+
+    def __init__(self, terms: Iterable[str]):
+        terms = list(terms)
+        normalized = [_normalize(t) for t in terms]
+        invalid = [t for t, n in zip(terms, normalized) if n is None]
+        if invalid:
+            raise ValueError(f"Invalid content filter terms: {', '.join(map(repr, invalid))}")
+        self.terms = frozenset(normalized)
+        self._trie = _build_trie(self.terms)
+        alternatives = [rf"(?P<term>\b{_trie_pattern(self._trie)}\b)"] if self._trie else []
+        alternatives.append(_DISALLOWED)
+        self._pattern = re.compile("|".join(alternatives))
+
+    def _term_for(self, word: str) -> str:
+        """The configured term that matched `word`: the exact term, else the longest stem."""
+        word = re.sub(_SEPARATOR_PATTERN, _SEPARATOR, word)
+        node, stem = self._trie, None
+        for i, char in enumerate(word):
+            if _STEM in node:
+                stem = word[:i] + _STEM
+            node = node.get(char)
+            if node is None:
+                return stem
+        if _EXACT in node:
+            return word
+        return word + _STEM if _STEM in node else stem
+
+    def apply(self, text: str) -> FilterResult:
+        """Lowercase `text`, drop restricted terms and disallowed characters, collapse whitespace."""
+        hits = Counter()
+
+        def remove(match):
+            if match.lastgroup == "term":
+                hits[self._term_for(match.group())] += 1
+            return ""
+
+        cleaned = self._pattern.sub(remove, text.lower())
+        return FilterResult(" ".join(cleaned.split()), hits)
+
+
+@lru_cache(maxsize=8)
+def _compiled(terms: frozenset) -> ContentFilter:
+    return ContentFilter(terms)
+
+
+def get_content_filter(terms: Iterable[str]) -> ContentFilter:
+    """A compiled filter for `terms`, shared by every pipeline using the same list."""
+    return _compiled(frozenset(terms))
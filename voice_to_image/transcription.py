@@ -0,0 +1,199 @@
+"""Parallel transcription of long recordings.
+
+A clip longer than `max_segment_seconds` is decoded once with ffmpeg to 16 kHz
+mono PCM while `silencedetect` reports its pauses. It is then cut near every
+`segment_seconds`, preferring the middle of a pause to a hard cut, and each
+segment is padded by `overlap_seconds` on both sides so no word is lost at a
+boundary. Segments are written as WAV in memory, transcribed concurrently by the
+backend (at most `max_workers` requests at a time), and the transcripts are
+joined in order with the words repeated across each overlap removed.
+
+The backend is any callable `(audio_bytes, filename) -> text`, so the pipeline
+can use Whisper and tests or benchmarks can use a local fake.
+"""
+import io
+import re
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from audio_prep import FFmpegError, ffmpeg_binary, run_ffmpeg
+from utils import setup_logging
+
+
+log = setup_logging()
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+SILENCE_THRESHOLD_DB = -35
+MIN_SILENCE_SECONDS = 0.3
+# No supported upload is below 24 kbit/s, so a smaller clip cannot be long
+# enough to split and is sent without decoding it first.
+MIN_BYTES_PER_SECOND = 3000
+OVERLAP_MATCH_WORDS = 12
+EDGE_SLACK_WORDS = 1
+
+Transcriber = Callable[[bytes, str], str]
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+def decode_with_silences(audio_data: bytes, filename: str) -> Tuple[bytes, List[Tuple[float, float]]]:
+    """16 kHz mono 16-bit PCM of the clip and its (start, end) pauses in seconds, in one ffmpeg pass."""
+    result = run_ffmpeg(audio_data, filename, [
+        "-vn",
+        "-af", f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:duration={MIN_SILENCE_SECONDS}",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ], loglevel="info")
+    pcm = result.stdout
+    duration = len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+    silences, start = [], None
+    for line in result.stderr.decode(errors="replace").splitlines():
+        if (match := _SILENCE_START.search(line)):
+            start = max(float(match.group(1)), 0.0)
+        elif (match := _SILENCE_END.search(line)) and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    if start is not None:  # silent until the end of the clip
+        silences.append((start, duration))
+    return pcm, silences
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, float]], segment_seconds: float,
+                  max_segment_seconds: float, overlap_seconds: float) -> List[Tuple[float, float]]:
+    """(start, end) of each segment: cut at the pause nearest every `segment_seconds`, plus overlap."""
+    pauses = [(start + end) / 2 for start, end in silences]
+    cuts = [0.0]
+    while duration - cuts[-1] > max_segment_seconds:
+        target = cuts[-1] + segment_seconds
+        candidates = [p for p in pauses if cuts[-1] + segment_seconds / 2 <= p <= cuts[-1] + max_segment_seconds]
+        cuts.append(min(candidates, key=lambda p: abs(p - target)) if candidates else target)
+    cuts.append(duration)
+    return [
+        (max(start - overlap_seconds, 0.0), min(end + overlap_seconds, duration))
+        for start, end in zip(cuts, cuts[1:])
+    ]
+
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def _edge_overlap(tail: List[str], head: List[str]) -> Optional[Tuple[int, int]]:
+    """(i, j) such that tail[i:] and head[j:] start the same run reaching the end of `tail`.
+
+    One unmatched word is allowed at either edge, where a segment boundary may
+    cut a word that only one side heard properly.
+    """
+    best, best_key = None, None
+    for i in range(len(tail)):
+        for j in range(min(EDGE_SLACK_WORDS + 1, len(head))):
+            size = 0
+            while i + size < len(tail) and j + size < len(head) and tail[i + size] == head[j + size]:
+                size += 1
+            slack = (len(tail) - i - size) + j
+            if size == 0 or len(tail) - i - size > EDGE_SLACK_WORDS:
+                continue
+            # A single shared word only counts when it is exactly where the segments meet.
+            if size == 1 and slack:
+                continue
+            key = (size, -slack)
+            if best_key is None or key > best_key:
+                best, best_key = (i, j), key
+    return best
+
+
+def stitch_transcripts(texts: List[str], max_overlap_words: int = OVERLAP_MATCH_WORDS) -> str:
+    """Join consecutive transcripts, dropping the words the overlap made both of them contain."""
+    words = []
+    for text in texts:
+        following = text.split()
+        tail, head = words[-max_overlap_words:], following[:max_overlap_words]
+        overlap = _edge_overlap([_normalize_word(w) for w in tail], [_normalize_word(w) for w in head])
+        if overlap is None:
+            words += following
+        else:
+            i, j = overlap
+            words = words[:len(words) - len(tail) + i] + following[j:]
+    return " ".join(words)
+
+
+def _wav_duration(audio_data: bytes) -> Optional[float]:
+    try:
+        with wave.open(io.BytesIO(audio_data), "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+
+class SegmentedTranscriber:
+
+    def __init__(self, backend: Transcriber, segment_seconds: float = 60.0,
+                 max_segment_seconds: float = 90.0, overlap_seconds: float = 1.0, max_workers: int = 4):
+        self.backend = backend
+        self.segment_seconds = segment_seconds
+        self.max_segment_seconds = max(max_segment_seconds, segment_seconds)
+        self.overlap_seconds = overlap_seconds
+        self.max_workers = max_workers
+
+    def _fits_one_request(self, audio_data: bytes, audio_filename: str) -> bool:
+        if len(audio_data) <= self.max_segment_seconds * MIN_BYTES_PER_SECOND or not ffmpeg_binary():
+            return True
+        if Path(audio_filename).suffix.lower() == ".wav":
+            duration = _wav_duration(audio_data)
+            return duration is not None and duration <= self.max_segment_seconds
+        return False
+
+    def transcribe(self, audio_data: bytes, audio_filename: str) -> str:
+        if self._fits_one_request(audio_data, audio_filename):
+            return self.backend(audio_data, audio_filename)
+
+        try:
+            pcm, silences = decode_with_silences(audio_data, audio_filename)
+        except FFmpegError as error:
+            log.warning(f"Segmentation skipped, sending the clip in one request | {error}")
+            return self.backend(audio_data, audio_filename)
+
+        duration = len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+        if duration <= self.max_segment_seconds:
+            return self.backend(audio_data, audio_filename)
+
+        segments = plan_segments(duration, silences, self.segment_seconds,
+                                 self.max_segment_seconds, self.overlap_seconds)
+        stem = Path(audio_filename).stem or "audio"
+        bytes_per_second = SAMPLE_RATE * SAMPLE_WIDTH
+        log.info(
+            f"Transcribing in segments | Duration: {duration:.1f}s | Segments: {len(segments)} | "
+            f"Pauses found: {len(silences)} | Parallel: {min(self.max_workers, len(segments))}"
+        )
+
+        def transcribe_segment(index: int) -> str:
+            start, end = segments[index]
+            chunk = pcm[int(start * SAMPLE_RATE) * SAMPLE_WIDTH:int(end * SAMPLE_RATE) * SAMPLE_WIDTH]
+            started = time.perf_counter()
+            text = self.backend(pcm_to_wav(chunk), f"{stem}.part{index:02d}.wav")
+            log.info(
+                f"Segment {index + 1}/{len(segments)} done | {start:.1f}-{end:.1f}s | "
+                f"{len(chunk) / bytes_per_second:.1f}s audio | {time.perf_counter() - started:.1f}s"
+            )
+            return text
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(segments)),
+                                thread_name_prefix="transcribe") as pool:
+            texts = list(pool.map(transcribe_segment, range(len(segments))))
+        return stitch_transcripts(texts)
@@ -73,6 +73,22 @@ def validate_audio_format(filename: str) -> bool:
     return extension in supported_extensions
 
 
+AUDIO_MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'mp4': 'audio/mp4',
+    'm4a': 'audio/mp4',
+    'webm': 'audio/webm',
+    'wav': 'audio/wav',
+    'ogg': 'audio/ogg',
+    'flac': 'audio/flac',
+}
+
+
+def audio_mime_type(filename: str) -> str:
+    extension = Path(filename).suffix.lstrip('.').lower()
+    return AUDIO_MIME_TYPES.get(extension, 'application/octet-stream')
+
+
 def format_file_size(size_bytes: int) -> str:
     for unit in ['B', 'KB', 'MB', 'GB']:
         if size_bytes < 1024.0: